@@ -0,0 +1,293 @@
+"""
+自适应并发限制器
+09-async-semaphore.py 中固定的 Semaphore(3): 后端快时吞吐量用不满，后端慢时又会把它压垮
+AdaptiveLimiter 根据观测到的延迟和错误调整并发窗口，用法与信号量相同: async with limiter
+每个窗口 (约一个往返的完成数) 调整一次:
+- aimd: 平均延迟超过基线的 tolerance 倍或出错时窗口乘以 backoff，否则窗口加 1
+- gradient: 窗口按 tolerance * 基线延迟 / 平均延迟 缩放，再加上 sqrt(窗口) 的探测余量
+基线是观测到的最小延迟，每隔 probe_interval 秒用一个低并发窗口重新测量，
+后端整体变慢 (不是过载) 时基线也会跟着移动
+"""
+import asyncio
+import collections
+import math
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit=3, min_limit=1, max_limit=200, algorithm='gradient',
+                 tolerance=1.5, backoff=0.9, smoothing=0.5, probe_interval=1.0):
+        self._limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.algorithm = algorithm
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval  # 最长多久重新测量一次空载延迟
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.starts = {}  # 任务 -> 获得许可的时间栈，同一个任务可以嵌套 async with
+        self.min_rtt = None  # 空载延迟基线
+        self.min_rtt_at = 0.0
+        self.short_rtt = None  # 上一个窗口的平均延迟
+        self.probe_saved = None  # 探测期间保存的窗口
+        self.window_start = time.perf_counter()
+        self.window_samples = 0
+        self.window_drops = 0
+        self.window_rtt_sum = 0.0
+        self.window_min_rtt = math.inf
+        self.samples = 0
+        self.drops = 0
+        self.acquired = 0
+        self.queued_total = 0
+        self.max_queued = 0
+        self.wait_time = 0.0
+
+    @property
+    def limit(self):
+        """当前并发窗口"""
+        return max(self.min_limit, int(self._limit))
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self.acquired += 1
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiters.append(future)
+        self.queued_total += 1
+        self.max_queued = max(self.max_queued, len(self.waiters))
+        start = loop.time()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经拿到许可但随即被取消: 把许可还回去
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self.waiters.remove(future)
+            raise
+        self.wait_time += loop.time() - start
+        self.acquired += 1
+
+    def release(self, rtt=None, dropped=False):
+        """归还许可，rtt 为请求耗时，dropped 表示请求失败 (超时、5xx 等)"""
+        if rtt is not None:
+            self._on_sample(rtt, dropped)
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # 许可直接转交给等待者，在 future 完成前就计入 in_flight
+        while self.waiters and self.in_flight < self.limit:
+            future = self.waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _on_sample(self, rtt, dropped):
+        # 每个窗口 (大约一个往返的完成数) 只调整一次并发窗口，与 TCP 每个 RTT 调整一次类似
+        self.samples += 1
+        self.window_samples += 1
+        if dropped:
+            self.drops += 1
+            self.window_drops += 1
+        else:
+            self.window_rtt_sum += rtt
+            self.window_min_rtt = min(self.window_min_rtt, rtt)
+        now = time.perf_counter()
+        if self.window_samples < self.limit and now - self.window_start < 1.0:
+            return
+        completed = self.window_samples - self.window_drops
+        avg_rtt = self.window_rtt_sum / completed if completed else None
+        window_min, drops = self.window_min_rtt, self.window_drops
+        self.window_start = now
+        self.window_samples = self.window_drops = 0
+        self.window_rtt_sum = 0.0
+        self.window_min_rtt = math.inf
+        if avg_rtt is not None:
+            self.short_rtt = avg_rtt
+
+        if self.probe_saved is not None:
+            # 探测窗口结束: 这一窗口的并发很低，它的最小延迟就是后端当前的空载延迟
+            if window_min != math.inf:
+                self.min_rtt, self.min_rtt_at = window_min, now
+            self._limit, self.probe_saved = self.probe_saved, None
+            return
+        if window_min < (self.min_rtt or math.inf):
+            self.min_rtt, self.min_rtt_at = window_min, now
+        if self.min_rtt is not None and now - self.min_rtt_at > self.probe_interval:
+            # 基线过期 (后端可能整体变慢了): 用一个低并发窗口重新测量
+            self.probe_saved = self._limit
+            self._limit = max(self.min_limit, self._limit / 4)
+            return
+        if avg_rtt is None and not drops:
+            return
+
+        # 窗口没有用满时 (应用本身的并发不够) 延迟不代表后端的容量，不增长
+        saturated = self.in_flight * 2 >= self._limit
+        if drops:
+            new_limit = self._limit * self.backoff
+        elif self.algorithm == 'aimd':
+            if avg_rtt > self.min_rtt * self.tolerance:
+                new_limit = self._limit * self.backoff
+            else:
+                new_limit = self._limit + 1 if saturated else self._limit
+        else:
+            gradient = max(0.5, min(1.0, self.tolerance * self.min_rtt / avg_rtt))
+            new_limit = self._limit * gradient
+            if saturated:
+                new_limit += math.sqrt(self._limit)  # 允许少量排队，用来探测更多容量
+            new_limit = self._limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self._limit = max(self.min_limit, min(self.max_limit, new_limit))
+
+    async def __aenter__(self):
+        await self.acquire()
+        self.starts.setdefault(asyncio.current_task(), []).append(time.perf_counter())
+
+    async def __aexit__(self, exc_type, exc, tb):
+        task = asyncio.current_task()
+        stack = self.starts[task]
+        start = stack.pop()
+        if not stack:
+            del self.starts[task]
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            self.release()  # 取消不作为延迟样本
+        else:
+            self.release(time.perf_counter() - start, dropped=exc_type is not None)
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'queued': len(self.waiters),
+            'max_queued': self.max_queued,
+            'queued_total': self.queued_total,
+            'avg_wait': self.wait_time / self.queued_total if self.queued_total else 0.0,
+            'samples': self.samples,
+            'drops': self.drops,
+            'min_rtt': self.min_rtt,
+            'short_rtt': self.short_rtt,
+        }
+
+
+async def fetch_with_semaphore(semaphore, session, url):
+    async with semaphore:  # semaphore 可以是 asyncio.Semaphore 或 AdaptiveLimiter
+        async with session.get(url, raise_for_status=True) as response:
+            return await response.text()
+
+
+# ---------------- 本地模拟后端 ----------------
+
+class Backend:
+    """延迟随并发线性增长 (capacity 个 "核")，并发超过 capacity * 4 时直接返回 503"""
+
+    def __init__(self, latency=0.01, capacity=32):
+        self.latency = latency
+        self.capacity = capacity
+        self.in_flight = 0
+
+    async def handle(self, request):
+        if self.in_flight >= self.capacity * 4:
+            return web.Response(status=503, text="overloaded")
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency * max(1.0, self.in_flight / self.capacity))
+        finally:
+            self.in_flight -= 1
+        return web.Response(text="ok")
+
+
+async def start_backend(backend):
+    app = web.Application()
+    app.router.add_get('/', backend.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://localhost:{port}/"
+
+
+# 测试: 三个阶段 快 -> 慢且容量小 -> 快，每种限制器持续压测
+PHASES = [(0.05, 32), (0.2, 4), (0.05, 32)]  # (基础延迟, 容量)
+PHASE_SECONDS = 3.0
+CLIENTS = 150
+
+
+async def benchmark(name, limiter):
+    backend = Backend()
+    runner, url = await start_backend(backend)
+    phase_stats = [{'ok': 0, 'errors': 0, 'latencies': [], 'limits': []} for _ in PHASES]
+    phase = 0
+
+    async def client(session):
+        while phase < len(PHASES):
+            current = phase_stats[phase]
+            start = time.perf_counter()
+            try:
+                await fetch_with_semaphore(limiter, session, url)
+                current['ok'] += 1
+                current['latencies'].append(time.perf_counter() - start)
+            except aiohttp.ClientError:
+                current['errors'] += 1
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        clients = [asyncio.create_task(client(session)) for _ in range(CLIENTS)]
+        for phase, (latency, capacity) in enumerate(PHASES):
+            backend.latency, backend.capacity = latency, capacity
+            phase_end = time.perf_counter() + PHASE_SECONDS
+            while time.perf_counter() < phase_end:
+                await asyncio.sleep(0.1)
+                if isinstance(limiter, AdaptiveLimiter):
+                    phase_stats[phase]['limits'].append(limiter.limit)
+        phase = len(PHASES)
+        await asyncio.gather(*clients)
+    await runner.cleanup()
+
+    print(f"\n{name}")
+    for (latency, capacity), current in zip(PHASES, phase_stats):
+        latencies = sorted(current['latencies'])
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+        limits = current['limits']
+        window = f", 窗口 {min(limits)}~{max(limits)}" if limits else ""
+        print(f"  后端 {latency * 1000:.0f}ms/容量 {capacity:2}: {current['ok'] / PHASE_SECONDS:6.0f} 请求/秒, "
+              f"错误 {current['errors']:5}, p50 {p50:6.1f}ms, p99 {p99:7.1f}ms{window}")
+    if isinstance(limiter, AdaptiveLimiter):
+        print(f"  统计: {limiter.stats()}")
+
+
+async def main():
+    # 与信号量用法相同
+    limiter = AdaptiveLimiter()
+    backend = Backend()
+    runner, url = await start_backend(backend)
+    async with aiohttp.ClientSession() as session:
+        tasks = [fetch_with_semaphore(limiter, session, url) for _ in range(10)]
+        results = await asyncio.gather(*tasks)
+    await runner.cleanup()
+    print(f"Downloaded {len(results)} URLs, limiter: {limiter.stats()}")
+
+    # 同一个任务中嵌套使用，每层各自记录开始时间
+    async with limiter:
+        async with limiter:
+            await asyncio.sleep(0.01)
+    print(f"嵌套 async with 之后: in_flight={limiter.in_flight}, samples={limiter.samples}")
+
+    await benchmark("Semaphore(3)", asyncio.Semaphore(3))
+    await benchmark("Semaphore(64)", asyncio.Semaphore(64))
+    await benchmark("AdaptiveLimiter(aimd)", AdaptiveLimiter(algorithm='aimd'))
+    await benchmark("AdaptiveLimiter(gradient)", AdaptiveLimiter(algorithm='gradient'))
+
+
+# 需要安装 aiohttp: pip install aiohttp
+asyncio.run(main())
@@ -0,0 +1,228 @@
+"""
+按主机限速、连接池调优和流式读取的 HTTP 客户端
+07-async-http-client.py 用默认的 ClientSession，并用 response.text() 把整个响应体读成一个字符串
+HttpClient 在它的基础上:
+- 每个主机一个令牌桶，限制请求速率 (可以为单个主机单独配置)
+- 调整连接池大小、每主机连接数和 keep-alive 时间，复用连接，并统计新建/复用的连接数
+- 流式读取: iter_chunks 逐块产出响应体，download 直接写入磁盘，内存占用只与块大小有关
+"""
+import asyncio
+import collections
+import os
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+CHUNK_SIZE = 64 * 1024
+
+
+class TokenBucket:
+    """令牌以 rate 个/秒的速度补充，最多积累 burst 个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # 先扣除令牌 (可以变成负数，相当于预约)，再等待欠下的令牌补齐，等待者按到达顺序放行
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class HttpClient:
+    def __init__(self, rate=None, burst=None, host_rates=None, limit=100, limit_per_host=20,
+                 keepalive_timeout=30, timeout=60):
+        self.rate = rate  # 默认每个主机每秒的请求数，None 表示不限速
+        self.burst = burst
+        self.host_rates = host_rates or {}  # 单独配置的主机 -> 速率
+        self.buckets = {}
+        self.connector_options = {
+            'limit': limit,  # 连接池总连接数
+            'limit_per_host': limit_per_host,  # 每个主机的连接数
+            'keepalive_timeout': keepalive_timeout,  # 空闲连接保留的秒数
+            'ttl_dns_cache': 300,
+        }
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+        self.stats = collections.Counter()
+
+    async def __aenter__(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_create)
+        trace.on_connection_reuseconn.append(self._on_connection_reuse)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(**self.connector_options),
+                                             timeout=self.timeout,
+                                             trace_configs=[trace])
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    async def _on_connection_create(self, session, context, params):
+        self.stats['connections_created'] += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self.stats['connections_reused'] += 1
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            rate = self.host_rates.get(host, self.rate)
+            self.buckets[host] = TokenBucket(rate, self.burst) if rate else None
+        return self.buckets[host]
+
+    async def request(self, method, url, **kwargs):
+        """限速后发出请求，返回尚未读取响应体的 response，调用方负责释放"""
+        bucket = self.bucket(url)
+        if bucket is not None:
+            await bucket.acquire()
+        self.stats['requests'] += 1
+        return await self.session.request(method, url, raise_for_status=True, **kwargs)
+
+    async def fetch_text(self, url):
+        """与 fetch_url 相同: 读取整个响应体"""
+        async with await self.request('GET', url) as response:
+            return await response.text()
+
+    async def iter_chunks(self, url, chunk_size=CHUNK_SIZE):
+        """逐块产出响应体，同一时刻只持有一个块"""
+        async with await self.request('GET', url) as response:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                self.stats['bytes'] += len(chunk)
+                yield chunk
+
+    async def download(self, url, path, chunk_size=CHUNK_SIZE):
+        """把响应体直接写入文件，返回字节数
+        写入页缓存的单个块很快，这里直接写，不切换到线程池"""
+        size = 0
+        with open(path, 'wb') as f:
+            async for chunk in self.iter_chunks(url, chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+
+async def fetch_url(session, url):
+    """07-async-http-client.py 中的实现，用于对比"""
+    async with session.get(url) as response:
+        return await response.text()
+
+
+# ---------------- 本地测试服务器 ----------------
+
+BODY = b'x' * (8 * 1024 * 1024)
+
+
+async def blob(request):
+    """分块写出响应体，write 会等待发送缓冲区排空，服务器端不会把整个响应体堆在内存中"""
+    size = int(request.match_info['size']) * 1024 * 1024
+    response = web.StreamResponse(headers={'Content-Type': 'text/plain'})
+    response.content_length = size
+    await response.prepare(request)
+    view = memoryview(BODY)
+    for offset in range(0, size, CHUNK_SIZE):
+        await response.write(view[offset:min(offset + CHUNK_SIZE, size)])
+    await response.write_eof()
+    return response
+
+
+async def small(request):
+    return web.Response(text="ok")
+
+
+async def start_server():
+    app = web.Application()
+    app.add_routes([
+        web.get('/', small),
+        web.get('/blob/{size}', blob)
+    ])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def measure(name, coro_factory, total_bytes):
+    """先测吞吐量，再在 tracemalloc 下重跑一次测峰值内存"""
+    start = time.perf_counter()
+    await coro_factory()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    await coro_factory()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:28} {total_bytes / 1024 / 1024 / elapsed:7.0f} MB/秒, 峰值内存 {peak / 1024 / 1024:7.1f} MB")
+
+
+async def main():
+    runner, port = await start_server()
+    base = f"http://127.0.0.1:{port}"
+
+    # 1. 按主机限速: localhost 和 127.0.0.1 是两个不同的主机，各自有令牌桶
+    hosts = [f"http://127.0.0.1:{port}/", f"http://localhost:{port}/"]
+    async with HttpClient(rate=100, burst=10, host_rates={f"localhost:{port}": 25}) as client:
+        for url in hosts:
+            start = time.perf_counter()
+            await asyncio.gather(*(client.fetch_text(url) for _ in range(60)))
+            elapsed = time.perf_counter() - start
+            print(f"{url}: 60 个请求, {60 / elapsed:.0f} 请求/秒")
+        print(f"连接统计: {dict(client.stats)}")
+
+    # 2. 连接复用: 每个请求新建会话 vs 共享调优后的连接池
+    n = 500
+    start = time.perf_counter()
+    for _ in range(n):
+        async with aiohttp.ClientSession() as session:
+            await fetch_url(session, base + '/')
+    print(f"\n每个请求新建会话: {n / (time.perf_counter() - start):.0f} 请求/秒, 新建连接 {n} 个")
+    async with HttpClient() as client:
+        start = time.perf_counter()
+        for _ in range(n):
+            await client.fetch_text(base + '/')
+        elapsed = time.perf_counter() - start
+        print(f"共享连接池 + keep-alive: {n / elapsed:.0f} 请求/秒, "
+              f"新建连接 {client.stats['connections_created']} 个, 复用 {client.stats['connections_reused']} 次")
+
+    # 3. 大响应体: 10 个并发请求，每个 8MB
+    concurrency, size_mb = 10, 8
+    url = f"{base}/blob/{size_mb}"
+    total = concurrency * size_mb * 1024 * 1024
+    print(f"\n{concurrency} 个并发请求, 每个 {size_mb} MB:")
+
+    async def read_text():
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(fetch_url(session, url) for _ in range(concurrency)))
+
+    async def read_chunks():
+        async with HttpClient() as client:
+            async def consume():
+                async for _ in client.iter_chunks(url):
+                    pass
+            await asyncio.gather(*(consume() for _ in range(concurrency)))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        async def read_to_disk():
+            async with HttpClient() as client:
+                await asyncio.gather(*(client.download(url, os.path.join(tmpdir, f'{i}.bin'))
+                                       for i in range(concurrency)))
+
+        await measure("response.text()", read_text, total)
+        await measure("iter_chunks (64KB)", read_chunks, total)
+        await measure("download (写入磁盘)", read_to_disk, total)
+
+    await runner.cleanup()
+
+
+# 需要安装 aiohttp: pip install aiohttp
+asyncio.run(main())
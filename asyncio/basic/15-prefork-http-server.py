@@ -0,0 +1,290 @@
+"""
+多核 prefork 模式的 HTTP 服务器
+08-async-http-server.py 只有一个事件循环和一个 TCPSite，只能用满一个 CPU 核
+这里由主进程 (supervisor) fork 出 N 个 worker，每个 worker 有自己的事件循环，
+都以 reuse_port=True 监听同一个端口，由内核把新连接分配给各个 worker
+- worker 崩溃后 supervisor 自动重新启动；启动后很快退出时按指数退避，
+  连续 MAX_EARLY_EXITS 次 (例如端口被占用、配置错误) 就放弃，停止所有 worker 并以退出码 1 退出
+- SIGHUP: 滚动重启，先启动新 worker 并等它开始监听，再让旧 worker 优雅退出
+- SIGTERM/SIGINT: 所有 worker 停止接受新连接，等待进行中的请求完成后退出
+注意: fork 必须发生在创建任何事件循环之前，supervisor 本身不运行事件循环
+
+用法: python 15-prefork-http-server.py --serve <worker 数> <端口> <处理延迟秒数>
+"""
+import asyncio
+import collections
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+import aiohttp
+from aiohttp import web
+
+GRACE = 10  # 优雅退出时等待进行中请求的秒数
+MIN_UPTIME = 1.0  # 运行不到这么多秒就退出的 worker 视为启动失败
+MAX_EARLY_EXITS = 5  # 连续启动失败这么多次后放弃
+BACKOFF = 0.5  # 第一次启动失败后的退避秒数，之后每次翻倍
+SIGNALS = {signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGHUP}
+
+
+async def handle(request):
+    delay = request.app['delay']
+    if delay:
+        await asyncio.sleep(delay)  # 模拟处理时间
+    name = request.match_info.get('name', "Anonymous")
+    return web.Response(text=f"Hello, {name}!", headers={'X-Worker': str(os.getpid())})
+
+
+def create_app(delay=0.5):
+    app = web.Application()
+    app['delay'] = delay
+    app.add_routes([
+        web.get('/', handle),
+        web.get('/{name}', handle)
+    ])
+    return app
+
+
+async def serve(host, port, delay, ready_fd):
+    runner = web.AppRunner(create_app(delay), access_log=None, shutdown_timeout=GRACE)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    await site.start()
+    # 通知 supervisor 已经开始监听
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+    # 先关闭监听套接字，再等待进行中的请求完成
+    await runner.cleanup()
+
+
+def run_worker(host, port, delay, ready_fd):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由 supervisor 处理
+    signal.pthread_sigmask(signal.SIG_SETMASK, [])  # 解除从 supervisor 继承的信号屏蔽
+    asyncio.run(serve(host, port, delay, ready_fd))
+
+
+class Supervisor:
+    def __init__(self, workers=None, host='localhost', port=8080, delay=0.5):
+        self.size = workers or os.cpu_count()
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.workers = {}  # pid -> 启动时间
+        self.retiring = set()  # 滚动重启中正在退出的旧 worker
+        self.restarts = 0
+        self.early_exits = 0  # 连续启动失败的次数
+
+    def spawn(self):
+        """fork 一个 worker，等到它开始监听后返回 pid"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                run_worker(self.host, self.port, self.delay, write_fd)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        self.workers[pid] = time.monotonic()
+        os.read(read_fd, 1)  # worker 启动失败时管道关闭，read 返回空
+        os.close(read_fd)
+        return pid
+
+    def reap(self):
+        """回收已经退出的 worker，产出 (pid, 启动时间, 退出码)"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            yield pid, self.workers.pop(pid, None), os.waitstatus_to_exitcode(status)
+
+    def on_child_exit(self):
+        """重新启动异常退出的 worker，连续启动失败 MAX_EARLY_EXITS 次时返回 False"""
+        for pid, started, code in self.reap():
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if started is not None and time.monotonic() - started < MIN_UPTIME:
+                self.early_exits += 1
+            else:
+                self.early_exits = 0
+            if self.early_exits >= MAX_EARLY_EXITS:
+                print(f"worker {pid} 异常退出 (退出码 {code})，连续 {self.early_exits} 次启动失败，放弃", flush=True)
+                return False
+            print(f"worker {pid} 异常退出 (退出码 {code})，重新启动", flush=True)
+            if self.early_exits:
+                time.sleep(BACKOFF * 2 ** (self.early_exits - 1))  # 启动即崩溃时指数退避，避免 fork 风暴
+            self.restarts += 1
+            self.spawn()
+        return True
+
+    def restart(self):
+        """滚动重启: 新 worker 先开始监听，旧 worker 再优雅退出，端口始终有人监听"""
+        for pid in list(self.workers):
+            self.spawn()
+            self.workers.pop(pid, None)
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+        print(f"滚动重启完成, worker: {sorted(self.workers)}", flush=True)
+
+    def stop(self):
+        for pid in list(self.workers) + list(self.retiring):
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + GRACE
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            for pid, _, _ in self.reap():
+                self.retiring.discard(pid)
+            time.sleep(0.05)
+        for pid in list(self.workers) + list(self.retiring):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    def run(self):
+        """运行到收到 SIGTERM/SIGINT (返回 True) 或者 worker 连续启动失败 (返回 False)"""
+        # 信号先屏蔽，在主循环中用 sigtimedwait 同步处理，避免在信号处理函数中 fork
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        for _ in range(self.size):
+            self.spawn()
+        print(f"Server started at http://{self.host}:{self.port} with {self.size} workers "
+              f"(supervisor {os.getpid()})", flush=True)
+        while True:
+            info = signal.sigtimedwait(SIGNALS, 1.0)
+            if info is None:
+                continue
+            if info.si_signo == signal.SIGCHLD:
+                if not self.on_child_exit():
+                    self.stop()
+                    return False
+            elif info.si_signo == signal.SIGHUP:
+                self.restart()
+            else:
+                self.stop()
+                print(f"Server stopped, 重启 worker {self.restarts} 次", flush=True)
+                return True
+
+
+# ---------------- 本地压测 ----------------
+
+async def load(url, duration, concurrency):
+    """在 duration 秒内用 concurrency 个 keep-alive 连接持续请求，统计各 worker 处理的请求数"""
+    per_worker = collections.Counter()
+    errors = collections.Counter()
+    deadline = time.monotonic() + duration
+
+    async def client(session):
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    per_worker[response.headers['X-Worker']] += 1
+            except aiohttp.ClientError as e:
+                errors[type(e).__name__] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    return {'requests': sum(per_worker.values()), 'errors': dict(errors), 'per_worker': dict(per_worker)}
+
+
+if len(sys.argv) == 5 and sys.argv[1] == '--serve':
+    sys.exit(0 if Supervisor(int(sys.argv[2]), '127.0.0.1', int(sys.argv[3]), float(sys.argv[4])).run() else 1)
+
+if len(sys.argv) == 5 and sys.argv[1] == '--load':
+    print(json.dumps(asyncio.run(load(sys.argv[2], float(sys.argv[3]), int(sys.argv[4])))))
+    sys.exit(0)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, port, delay, stderr=None):
+    server = subprocess.Popen([sys.executable, __file__, '--serve', str(workers), str(port), str(delay)],
+                              stdout=subprocess.PIPE, stderr=stderr, text=True)
+    print(server.stdout.readline().strip())
+    return server
+
+
+def worker_pids(server):
+    with open(f'/proc/{server.pid}/task/{server.pid}/children') as f:
+        return sorted(int(pid) for pid in f.read().split())
+
+
+def start_load(url, duration, concurrency, clients=1):
+    """压测客户端也放在独立进程中，多个客户端进程可以用满多个核"""
+    return [subprocess.Popen([sys.executable, __file__, '--load', url, str(duration), str(concurrency)],
+                             stdout=subprocess.PIPE, text=True)
+            for _ in range(clients)]
+
+
+def collect(load_processes):
+    total = {'requests': 0, 'errors': collections.Counter(), 'per_worker': collections.Counter()}
+    for process in load_processes:
+        result = json.loads(process.communicate()[0])
+        total['requests'] += result['requests']
+        total['errors'].update(result['errors'])
+        total['per_worker'].update(result['per_worker'])
+    return total
+
+
+# 测试 1: 崩溃自动重启和滚动重启，期间持续有请求 (处理延迟 0.05 秒)
+port = free_port()
+url = f"http://127.0.0.1:{port}/prefork"
+server = start_server(2, port, 0.05)
+print(f"worker: {worker_pids(server)}")
+load_processes = start_load(url, 4, 20)
+
+time.sleep(1)
+crashed = worker_pids(server)[0]
+os.kill(crashed, signal.SIGKILL)  # 模拟 worker 崩溃
+print(server.stdout.readline().strip())
+time.sleep(1)
+server.send_signal(signal.SIGHUP)  # 滚动重启
+print(server.stdout.readline().strip())
+
+result = collect(load_processes)
+print(f"重启期间: {result['requests']} 个请求, 错误 {dict(result['errors'])}, "
+      f"处理过请求的 worker 进程数 {len(result['per_worker'])}")
+server.send_signal(signal.SIGTERM)
+print(server.stdout.readline().strip())
+server.wait()
+
+# 端口已被占用 (没有设置 SO_REUSEPORT 的套接字): worker 每次启动都失败，退避几次后 supervisor 放弃
+with socket.socket() as blocker:
+    blocker.bind(('127.0.0.1', 0))
+    blocker.listen()
+    start = time.monotonic()
+    # worker 启动失败的 traceback 不显示
+    server = start_server(1, blocker.getsockname()[1], 0, stderr=subprocess.DEVNULL)
+    print(server.communicate()[0].strip())
+    print(f"supervisor 退出码 {server.returncode}, 耗时 {time.monotonic() - start:.1f} 秒")
+
+# 测试 2: 无处理延迟时每秒请求数随 worker 数的变化 (压测客户端进程数与 CPU 核数相同)
+cpus = os.cpu_count()
+print(f"\nCPU 核数: {cpus}")
+for workers in sorted({1, 2, cpus}):
+    port = free_port()
+    server = start_server(workers, port, 0)
+    result = collect(start_load(f"http://127.0.0.1:{port}/", 3, 50, clients=cpus))
+    server.send_signal(signal.SIGTERM)
+    server.communicate()
+    print(f"{workers} 个 worker: {result['requests'] / 3:.0f} 请求/秒, 错误 {dict(result['errors'])}, "
+          f"各 worker 请求数 {sorted(result['per_worker'].values())}")
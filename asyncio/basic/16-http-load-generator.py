@@ -0,0 +1,314 @@
+"""
+本地 HTTP 压测工具和延迟直方图
+用于测量 08-async-http-server.py 中的 handle 以及 07/09 中客户端写法在负载下的表现
+- 闭环 (closed): 固定数量的客户端，每个收到响应后立即发下一个请求
+- 开环 (open): 按固定到达速率发请求，不受服务器快慢影响；
+  延迟从计划发送时间开始计算，服务器变慢时排队时间也计入延迟 (避免 coordinated omission)
+延迟记录在 HDR 风格的对数-线性直方图中: 固定 3 位有效数字，内存与请求数无关，可以合并
+结果以 JSON 输出 (吞吐量、p50/p99/p999、错误率)，可以与基线对比，发现回退时返回码为 1
+默认在本机启动一个与 08 相同的服务器，全程只访问 localhost
+
+用法: python 16-http-load-generator.py [结果.json] [基线.json]
+"""
+import array
+import asyncio
+import collections
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+REGRESSION_TOLERANCE = 0.2  # 吞吐量下降或 p99 上升超过 20% 视为回退
+P99_NOISE_MS = 2.0  # p99 上升不到 2ms 时视为噪声
+SCENARIOS = [
+    # (名称, 模式, 并发数或每秒请求数, 服务器处理延迟)
+    ('closed-c50-delay0.5', 'closed', 50, 0.5),
+    ('open-r80-delay0.5', 'open', 80, 0.5),
+    ('closed-c20-delay0', 'closed', 20, 0.0),
+    ('open-r500-delay0', 'open', 500, 0.0),
+]
+DURATION = 3.0
+
+
+class LatencyHistogram:
+    """HDR 风格直方图: 每个 2 的幂区间内再线性分成 1024 份，相对误差不超过 0.1%
+    值以微秒为单位记录，max_value 以上的值记在最后一个桶里"""
+
+    SUB_BUCKET_BITS = 11  # 2048 个子桶 -> 3 位有效数字
+    SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self, max_value=60_000_000):
+        self.max_value = max_value
+        self.counts = array.array('Q', bytes(8 * (self._index(max_value) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        sub = value >> shift
+        if shift == 0:
+            return sub
+        return 2 * self.SUB_BUCKET_HALF + (shift - 1) * self.SUB_BUCKET_HALF + sub - self.SUB_BUCKET_HALF
+
+    def _value(self, index):
+        """桶中最大的值 (与 HdrHistogram 的 highestEquivalentValue 一致)"""
+        if index < 2 * self.SUB_BUCKET_HALF:
+            return index
+        shift, offset = divmod(index - 2 * self.SUB_BUCKET_HALF, self.SUB_BUCKET_HALF)
+        shift += 1
+        return ((self.SUB_BUCKET_HALF + offset) << shift) + (1 << shift) - 1
+
+    def record(self, seconds):
+        value = min(self.max_value, max(0, int(seconds * 1_000_000)))
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """返回毫秒"""
+        if not self.count:
+            return 0.0
+        target = max(1, int(self.count * p / 100 + 0.5))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._value(i), self.max) / 1000
+        return self.max / 1000
+
+    def summary(self):
+        return {
+            'min': (self.min or 0) / 1000,
+            'mean': self.total / self.count / 1000 if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max / 1000,
+        }
+
+
+class LoadResult:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = collections.Counter()
+        self.ok = 0
+
+    async def request(self, session, url, started):
+        """发一个请求，延迟从 started (计划发送时间) 开始计算"""
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                if response.status >= 400:
+                    self.errors[f'http_{response.status}'] += 1
+                    return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.errors[type(e).__name__] += 1
+            return
+        self.ok += 1
+        self.histogram.record(time.perf_counter() - started)
+
+
+async def closed_loop(session, url, concurrency, duration, result):
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await result.request(session, url, time.perf_counter())
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+
+async def open_loop(session, url, rate, duration, result, max_outstanding=10000):
+    """返回实际的发送速率，明显低于 rate 说明压测客户端本身跟不上"""
+    start = time.perf_counter()
+    tasks = set()
+    sent = int(rate * duration)
+    for i in range(sent):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # 落后于计划时立即补发，不跳过，延迟仍从计划时间算起
+        if len(tasks) >= max_outstanding:
+            result.errors['client_overloaded'] += 1
+            continue
+        task = asyncio.create_task(result.request(session, url, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    sent_rate = sent / (time.perf_counter() - start)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return sent_rate
+
+
+async def run_load(url, mode='closed', concurrency=10, rate=100, duration=10.0, timeout=30):
+    """对 url 压测 duration 秒，返回结果字典"""
+    result = LoadResult()
+    # 开环模式不限制连接数，否则请求会在客户端连接池中排队，掩盖服务器的延迟
+    connector = aiohttp.TCPConnector(limit=concurrency if mode == 'closed' else 0)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        sent_rate = None
+        if mode == 'closed':
+            await closed_loop(session, url, concurrency, duration, result)
+        else:
+            sent_rate = await open_loop(session, url, rate, duration, result)
+        # 包括最后一批请求完成的时间
+        elapsed = time.perf_counter() - start
+
+    errors = sum(result.errors.values())
+    total = result.ok + errors
+    return {
+        'mode': mode,
+        'concurrency': concurrency if mode == 'closed' else None,
+        'target_rate': rate if mode == 'open' else None,
+        'sent_rate': sent_rate,
+        'duration': elapsed,
+        'requests': total,
+        'errors': dict(result.errors),
+        'error_rate': errors / total if total else 0.0,
+        'throughput': result.ok / elapsed,
+        'latency_ms': result.histogram.summary(),
+    }
+
+
+# ---------------- 本地被测服务器 (与 08-async-http-server.py 相同) ----------------
+
+async def handle(request):
+    await asyncio.sleep(request.app['delay'])  # 模拟处理时间
+    name = request.match_info.get('name', "Anonymous")
+    return web.Response(text=f"Hello, {name}!")
+
+
+async def serve(port, delay):
+    app = web.Application()
+    app['delay'] = delay
+    app.add_routes([
+        web.get('/', handle),
+        web.get('/{name}', handle)
+    ])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    print("ready", flush=True)
+    try:
+        await asyncio.Future()
+    finally:
+        await runner.cleanup()
+
+
+if len(sys.argv) == 4 and sys.argv[1] == '--serve':
+    try:
+        asyncio.run(serve(int(sys.argv[2]), float(sys.argv[3])))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+
+def start_server(delay):
+    """被测服务器放在独立进程中，不和压测客户端争用同一个事件循环"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([sys.executable, __file__, '--serve', str(port), str(delay)],
+                              stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()
+    return server, f"http://127.0.0.1:{port}/"
+
+
+def run_scenarios():
+    results = []
+    for name, mode, load, delay in SCENARIOS:
+        server, url = start_server(delay)
+        try:
+            result = asyncio.run(run_load(url, mode, concurrency=load, rate=load, duration=DURATION))
+        finally:
+            server.terminate()
+            server.wait()
+        result['scenario'] = name
+        latency = result['latency_ms']
+        print(f"{name:22} {result['throughput']:7.0f} 请求/秒, 错误率 {result['error_rate']:.2%}, "
+              f"p50 {latency['p50']:7.2f}ms, p99 {latency['p99']:7.2f}ms, p999 {latency['p999']:7.2f}ms",
+              file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def find_regressions(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """对比两次结果，返回吞吐量下降、p99 上升超过 tolerance (且超过 P99_NOISE_MS) 或错误率上升的场景"""
+    old = {r['scenario']: r for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        before = old.get(r['scenario'])
+        if before is None:
+            continue
+        if r['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append({'scenario': r['scenario'], 'metric': 'throughput',
+                                'before': before['throughput'], 'after': r['throughput']})
+        p99, p99_before = r['latency_ms']['p99'], before['latency_ms']['p99']
+        if p99 > p99_before * (1 + tolerance) and p99 - p99_before > P99_NOISE_MS:
+            regressions.append({'scenario': r['scenario'], 'metric': 'p99_ms',
+                                'before': p99_before, 'after': p99})
+        if r['error_rate'] > before['error_rate'] + 0.001:
+            regressions.append({'scenario': r['scenario'], 'metric': 'error_rate',
+                                'before': before['error_rate'], 'after': r['error_rate']})
+    return regressions
+
+
+# 测试直方图: 记录 1 微秒 ~ 10 秒的值，分位数相对误差在 0.1% 以内
+histogram = LatencyHistogram()
+values = [i * 1e-6 for i in range(1, 10_000_001, 997)]
+for value in values:
+    histogram.record(value)
+exact = values[int(len(values) * 0.99) - 1] * 1000
+print(f"直方图: {histogram.count} 个值, 占用 {len(histogram.counts) * 8 // 1024} KB, "
+      f"p99 {histogram.percentile(99):.3f}ms (精确值 {exact:.3f}ms)", file=sys.stderr)
+
+report = {
+    'meta': {
+        'python': sys.version.split()[0],
+        'aiohttp': aiohttp.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'duration': DURATION,
+        'timestamp': time.time(),
+    },
+    'results': run_scenarios(),
+}
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"结果已写入 {sys.argv[1]}", file=sys.stderr)
+else:
+    print(json.dumps(report, indent=2))
+
+if len(sys.argv) > 2:
+    with open(sys.argv[2]) as f:
+        regressions = find_regressions(json.load(f), report)
+    for r in regressions:
+        print(f"性能回退: {r['scenario']} {r['metric']} {r['before']:.4f} -> {r['after']:.4f}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,303 @@
+"""
+带请求合并的响应缓存中间件
+08-async-http-server.py 中每次访问 / 或 /{name} 都会重新执行 handle (包括模拟的 0.5 秒处理时间)
+ResponseCache 按 路由 + 路径参数 + 查询参数 缓存 GET 请求的 200 响应:
+- 有界 LRU，超过 max_entries 时淘汰最久未使用的条目
+- ttl 秒内为新鲜条目，直接返回
+- 过期后 stale_ttl 秒内先返回旧响应，同时在后台重新生成 (stale-while-revalidate)
+- 同一个键的并发未命中只执行一次 handler，其余请求等待同一个结果 (请求合并)
+- 命中/未命中等计数可以通过 /_cache/stats 查看，用于调整容量和 ttl
+- 带 Authorization 或 Cookie 的请求不经过缓存；带 Set-Cookie、Vary 或
+  Cache-Control: private/no-store 的响应不缓存，避免把一个用户的响应返回给另一个用户
+注意: 后台刷新使用触发它的请求在仍然有效时 clone() 出的副本，只适合不读取请求体的 GET handler
+"""
+import asyncio
+import collections
+import time
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict, CIMultiDictProxy
+
+Entry = collections.namedtuple('Entry', ['status', 'body', 'headers', 'created'])
+SKIPPED_HEADERS = {'Content-Length', 'Date', 'Server'}
+PRIVATE_REQUEST_HEADERS = {'Authorization', 'Cookie'}
+PRIVATE_CACHE_CONTROL = {'private', 'no-store'}
+
+
+def no_cache(handler):
+    """标记不缓存的 handler"""
+    handler.no_cache = True
+    return handler
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, ttl=5.0, stale_ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl  # 过期后还可以先返回旧响应的秒数
+        self.entries = collections.OrderedDict()
+        self.inflight = {}  # 键 -> 正在生成响应的 Future
+        self.refreshing = set()  # 后台刷新任务，保存引用避免被垃圾回收
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def key(request):
+        route = request.match_info.route.resource
+        name = route.canonical if route is not None else request.path
+        return (name, tuple(sorted(request.match_info.items())), tuple(sorted(request.query.items())))
+
+    @staticmethod
+    def _cacheable(response):
+        """只缓存完整的 200 响应，并且响应不是针对特定用户或特定请求头的"""
+        if not (type(response) is web.Response and response.status == 200
+                and isinstance(response.body, bytes)):
+            return False
+        # set_cookie() 设置的 cookie 在发送前不在 headers 中
+        if response.cookies or 'Set-Cookie' in response.headers or 'Vary' in response.headers:
+            return False
+        directives = {directive.split('=', 1)[0].strip().lower()
+                      for directive in response.headers.get('Cache-Control', '').split(',')}
+        return not directives & PRIVATE_CACHE_CONTROL
+
+    def _begin(self, key):
+        """登记正在生成的键，之后的并发请求等待这个 Future，必须在 await 之前同步调用"""
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        return future
+
+    async def _generate(self, key, future, handler, request):
+        """执行 handler 并写入缓存，同一个键同一时刻只有一个在执行"""
+        try:
+            response = await handler(request)
+            if self._cacheable(response):
+                # CIMultiDict 保留重复的响应头 (例如多个 Link)
+                headers = CIMultiDict(response.headers)
+                for name in SKIPPED_HEADERS:
+                    headers.popall(name, None)
+                entry = Entry(response.status, response.body, CIMultiDictProxy(headers), time.monotonic())
+                self._store(key, entry)
+                future.set_result(entry)
+            else:
+                # 不可缓存的响应: 等待者各自重新执行 handler
+                future.set_result(None)
+            return response
+        except asyncio.CancelledError:
+            # 生成响应的请求被取消 (例如客户端断开): 等待者各自重新执行 handler
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不报 "exception was never retrieved"
+            raise
+        finally:
+            del self.inflight[key]
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _refresh(self, key, handler, request):
+        """后台重新生成响应: 原请求返回后就不能再使用，在它仍然有效时 clone 一份给 handler"""
+        future = self._begin(key)
+        request = request.clone()
+
+        async def refresh():
+            try:
+                await self._generate(key, future, handler, request)
+            except Exception:
+                self.stats['refresh_errors'] += 1
+        self.stats['refreshes'] += 1
+        task = asyncio.create_task(refresh())
+        self.refreshing.add(task)
+        task.add_done_callback(self.refreshing.discard)
+
+    @staticmethod
+    def _response(entry, state):
+        response = web.Response(body=entry.body, status=entry.status, headers=entry.headers)
+        response.headers['X-Cache'] = state
+        return response
+
+    def middleware(self):
+        @web.middleware
+        async def cache_middleware(request, handler):
+            if request.method != 'GET' or getattr(request.match_info.handler, 'no_cache', False):
+                return await handler(request)
+            if not PRIVATE_REQUEST_HEADERS.isdisjoint(request.headers):
+                self.stats['private_bypasses'] += 1
+                return await handler(request)
+            key = self.key(request)
+            entry = self.entries.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry.created
+                if age < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return self._response(entry, 'HIT')
+                if age < self.ttl + self.stale_ttl:
+                    self.entries.move_to_end(key)
+                    self.stats['stale_hits'] += 1
+                    if key not in self.inflight:
+                        self._refresh(key, handler, request)
+                    return self._response(entry, 'STALE')
+                del self.entries[key]
+
+            if key in self.inflight:
+                self.stats['coalesced'] += 1
+                future = self.inflight[key]
+                try:
+                    # shield: 这个请求被取消时不影响正在生成的响应
+                    entry = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise  # 被取消的是这个请求本身
+                    entry = None
+                if entry is not None:
+                    return self._response(entry, 'COALESCED')
+                return await handler(request)
+
+            self.stats['misses'] += 1
+            response = await self._generate(key, self._begin(key), handler, request)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return cache_middleware
+
+    def snapshot(self):
+        lookups = self.stats['hits'] + self.stats['stale_hits'] + self.stats['coalesced'] + self.stats['misses']
+        hit_rate = (lookups - self.stats['misses']) / lookups if lookups else 0.0
+        return {**self.stats, 'entries': len(self.entries), 'max_entries': self.max_entries,
+                'inflight': len(self.inflight), 'hit_rate': hit_rate}
+
+
+async def handle(request):
+    await asyncio.sleep(request.app['delay'])  # 模拟处理时间
+    request.app['counters']['calls'] += 1
+    name = request.match_info.get('name', "Anonymous")
+    return web.Response(text=f"Hello, {name}!")
+
+
+async def tags(request):
+    await asyncio.sleep(request.app['delay'])
+    response = web.Response(text="tags")
+    response.headers.add('X-Tag', 'a')
+    response.headers.add('X-Tag', 'b')
+    return response
+
+
+async def profile(request):
+    await asyncio.sleep(request.app['delay'])
+    request.app['counters']['profile_calls'] += 1
+    response = web.Response(text="Welcome back")
+    response.set_cookie('session', 'abc')
+    return response
+
+
+@no_cache
+async def cache_stats(request):
+    return web.json_response(request.app['cache'].snapshot())
+
+
+async def start_server(cache=None, delay=0.5):
+    app = web.Application(middlewares=[cache.middleware()] if cache else [])
+    app['cache'] = cache
+    app['delay'] = delay
+    app['counters'] = collections.Counter()
+    app.add_routes([
+        web.get('/_cache/stats', cache_stats),
+        web.get('/_tags', tags),
+        web.get('/_profile', profile),
+        web.get('/', handle),
+        web.get('/{name}', handle)
+    ])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, app, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+async def get(session, url):
+    start = time.perf_counter()
+    async with session.get(url) as response:
+        text = await response.text()
+        return text, response.headers.get('X-Cache'), time.perf_counter() - start
+
+
+async def benchmark(session, base, duration=3.0, clients=50, names=20):
+    """闭环压测: clients 个客户端轮流请求 names 个不同的路径"""
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(i):
+        nonlocal done
+        while time.perf_counter() < deadline:
+            await get(session, f"{base}/user{i % names}")
+            i += clients
+            done += 1
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    return done / duration
+
+
+async def main():
+    cache = ResponseCache(max_entries=100, ttl=1.0, stale_ttl=10.0)
+    runner, app, base = await start_server(cache)
+    # DummyCookieJar: 不保存 /_profile 设置的 cookie，否则之后的请求都会带 Cookie 而绕过缓存
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0),
+                                     cookie_jar=aiohttp.DummyCookieJar()) as session:
+        # 1. 100 个并发请求同一个未缓存的路径: 只执行一次 handle
+        start = time.perf_counter()
+        results = await asyncio.gather(*(get(session, f"{base}/alice") for _ in range(100)))
+        states = collections.Counter(state for _, state, _ in results)
+        print(f"100 个并发请求: 耗时 {time.perf_counter() - start:.2f} 秒, "
+              f"handle 执行 {app['counters']['calls']} 次, {dict(states)}")
+
+        # 2. 新鲜命中
+        text, state, elapsed = await get(session, f"{base}/alice")
+        print(f"再次请求: {text} [{state}] {elapsed * 1000:.1f}ms")
+
+        # 3. 过期后先返回旧响应，后台刷新
+        await asyncio.sleep(1.1)
+        text, state, elapsed = await get(session, f"{base}/alice")
+        print(f"过期后请求: {text} [{state}] {elapsed * 1000:.1f}ms")
+        await asyncio.sleep(0.6)
+        text, state, elapsed = await get(session, f"{base}/alice")
+        print(f"后台刷新后: {text} [{state}] {elapsed * 1000:.1f}ms, handle 执行 {app['counters']['calls']} 次")
+
+        # 查询参数不同是不同的缓存键
+        _, state, _ = await get(session, f"{base}/alice?lang=zh")
+        print(f"带查询参数: [{state}]")
+
+        # 重复的响应头在缓存命中时原样保留
+        for _ in range(2):
+            async with session.get(f"{base}/_tags") as response:
+                print(f"X-Tag: {response.headers.getall('X-Tag')} [{response.headers.get('X-Cache')}]")
+
+        # 带 Set-Cookie 的响应不缓存；带 Authorization/Cookie 的请求不经过缓存
+        for _ in range(2):
+            _, state, _ = await get(session, f"{base}/_profile")
+        print(f"Set-Cookie 响应: [{state}], handle 执行 {app['counters']['profile_calls']} 次")
+        for headers in ({'Authorization': 'Bearer token'}, {'Cookie': 'session=abc'}):
+            async with session.get(f"{base}/alice", headers=headers) as response:
+                print(f"请求头 {list(headers)}: X-Cache={response.headers.get('X-Cache')}")
+        async with session.get(f"{base}/_cache/stats") as response:
+            print(f"缓存统计: {await response.json()}")
+    await runner.cleanup()
+
+    # 4. 吞吐量对比: 50 个客户端, 20 个不同的路径
+    for name, cache in (("无缓存", None), ("响应缓存 (ttl 1 秒)", ResponseCache(ttl=1.0))):
+        runner, app, base = await start_server(cache)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            rate = await benchmark(session, base)
+        await runner.cleanup()
+        print(f"\n{name}: {rate:.0f} 请求/秒, handle 执行 {app['counters']['calls']} 次")
+        if cache:
+            print(f"缓存统计: {cache.snapshot()}")
+
+
+# 需要安装 aiohttp: pip install aiohttp
+asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+基于 asyncio.create_subprocess_exec 的批量命令执行引擎
+不再为每个命令占用一个执行线程，并发数由 Semaphore 限制
+注意: Python 3.11 默认的 ThreadedChildWatcher 仍然为每个子进程创建一个线程等待退出，
+支持 pidfd 时用 use_pidfd_child_watcher 换成 PidfdChildWatcher (3.12 起已是默认)
+结果按完成顺序逐个产出，返回结构与 05-batch-execute.py 保持一致
+"""
+import asyncio
+import concurrent.futures
+import os
+import subprocess
+import sys
+import time
+
+
+def use_pidfd_child_watcher():
+    """子进程退出改由事件循环上的 pidfd 通知，不再为每个子进程创建等待线程，返回是否生效"""
+    if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return False
+    asyncio.set_child_watcher(asyncio.PidfdChildWatcher())
+    return True
+
+
+async def run_command(cmd, semaphore):
+    """异步执行单个命令并返回结果"""
+    async with semaphore:  # 限制同时运行的子进程数
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                # 与 check=True 抛出的 CalledProcessError 信息保持一致
+                raise subprocess.CalledProcessError(process.returncode, cmd,
+                                                    stdout, stderr)
+            return {
+                'cmd': cmd,
+                'success': True,
+                'output': stdout.decode()
+            }
+        except Exception as e:
+            return {
+                'cmd': cmd,
+                'success': False,
+                'error': str(e)
+            }
+
+
+async def iter_batch_execute(commands, max_concurrency=64):
+    """并发执行多个命令，按完成顺序逐个产出结果"""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [asyncio.create_task(run_command(cmd, semaphore)) for cmd in commands]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # 调用方提前退出时取消尚未完成的任务
+        for task in tasks:
+            task.cancel()
+
+
+async def batch_execute(commands, max_concurrency=64):
+    """并发执行多个命令，返回全部结果"""
+    return [result async for result in iter_batch_execute(commands, max_concurrency)]
+
+
+def thread_pool_batch_execute(commands, max_workers=5):
+    """05-batch-execute.py 中基于线程池的实现，用于对比"""
+    def run(cmd):
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            return {'cmd': cmd, 'success': True, 'output': result.stdout}
+        except Exception as e:
+            return {'cmd': cmd, 'success': False, 'error': str(e)}
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_cmd = {executor.submit(run, cmd): cmd for cmd in commands}
+        for future in concurrent.futures.as_completed(future_to_cmd):
+            results.append(future.result())
+    return results
+
+
+# 测试批量执行
+commands = [
+    ['echo', 'Hello World'],
+    ['ls', '-l'],
+    ['date'],
+    ['whoami'],
+    ['non_existent_command']  # 这个会失败
+]
+
+
+async def main():
+    async for result in iter_batch_execute(commands):
+        if result['success']:
+            print(f"命令 {result['cmd']} 成功: {result['output'].strip()}")
+        else:
+            print(f"命令 {result['cmd']} 失败: {result['error']}")
+
+
+asyncio.run(main())
+
+# 吞吐量对比: 10000 个短命令，两种实现使用相同的并发数
+n = 10000
+concurrency = 64
+short_commands = [['true'] for _ in range(n)]
+
+
+def report(name, elapsed):
+    print(f"{name}: {n} 个命令耗时 {elapsed:.2f} 秒, {n / elapsed:.0f} 个/秒")
+
+
+start = time.perf_counter()
+thread_pool_batch_execute(short_commands, max_workers=concurrency)
+report(f"\nThreadPoolExecutor(max_workers={concurrency})", time.perf_counter() - start)
+
+start = time.perf_counter()
+asyncio.run(batch_execute(short_commands, max_concurrency=concurrency))
+report(f"asyncio 引擎(max_concurrency={concurrency}, 默认 child watcher)", time.perf_counter() - start)
+
+if use_pidfd_child_watcher():
+    start = time.perf_counter()
+    asyncio.run(batch_execute(short_commands, max_concurrency=concurrency))
+    report(f"asyncio 引擎(max_concurrency={concurrency}, PidfdChildWatcher)", time.perf_counter() - start)
+# 命令都很短时瓶颈在进程创建本身，两种方式的吞吐量相近，asyncio 引擎不一定更快；
+# 它的优势是并发数很大时不需要同样多的线程
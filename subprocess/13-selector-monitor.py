@@ -0,0 +1,142 @@
+"""
+基于 selectors (Linux 上为 epoll) 的多进程输出监控
+文件描述符只注册一次，EOF 时注销
+非阻塞地按大块读取，增量切分行，没有固定的 sleep
+不受 select 的 FD_SETSIZE 限制，可以同时监控上千个子进程
+"""
+import os
+import selectors
+import subprocess
+import time
+
+CHUNK_SIZE = 65536
+
+
+def monitor_multiple_processes(commands, timeout=60, verbose=True):
+    """同时监控多个进程的输出"""
+    selector = selectors.DefaultSelector()
+    processes = []
+
+    # 启动所有命令，并一次性注册 stdout/stderr
+    for i, cmd in enumerate(commands):
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        p = {
+            'process': process,
+            'cmd': cmd,
+            'index': i,
+            'stdout_lines': [],
+            'stderr_lines': [],
+            'open_streams': 2
+        }
+        processes.append(p)
+        for stream_name, stream in (('stdout', process.stdout), ('stderr', process.stderr)):
+            os.set_blocking(stream.fileno(), False)
+            # data 中保存所属进程、流名称和尚未凑成整行的残余数据
+            selector.register(stream, selectors.EVENT_READ, [p, stream_name, b''])
+
+    # 输出已经关闭但进程还在运行 (例如关闭了 stdout/stderr 的后台进程)，不能阻塞地 wait
+    exiting = []
+
+    def on_exit(p):
+        p['exit_code'] = p['process'].returncode
+        if verbose:
+            print(f"进程 {p['index']} ({' '.join(p['cmd'])}) 已结束，返回码: {p['exit_code']}")
+
+    def emit(p, stream_name, line):
+        line = line.decode(errors='replace').strip()
+        p[f'{stream_name}_lines'].append(line)
+        if verbose:
+            print(f"进程 {p['index']} ({' '.join(p['cmd'])}) {stream_name}: {line}")
+
+    deadline = time.monotonic() + timeout
+
+    while selector.get_map() or exiting:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        # 阻塞等待，直到有数据或超时; 只有存在输出已关闭的进程时才定期 poll
+        for key, _ in selector.select(min(remaining, 0.05) if exiting else remaining):
+            p, stream_name, pending = key.data
+            try:
+                chunk = os.read(key.fd, CHUNK_SIZE)
+            except BlockingIOError:
+                continue
+
+            if not chunk:
+                # EOF: 输出残余的半行，注销并关闭该流
+                if pending:
+                    emit(p, stream_name, pending)
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                p['open_streams'] -= 1
+                if p['open_streams'] == 0:
+                    exiting.append(p)
+                continue
+
+            # 增量切分行，最后一个不完整的行留到下次
+            lines = (pending + chunk).split(b'\n')
+            key.data[2] = lines.pop()
+            for line in lines:
+                emit(p, stream_name, line)
+
+        for p in exiting[:]:
+            if p['process'].poll() is not None:
+                exiting.remove(p)
+                on_exit(p)
+
+    # 超时: 关闭剩余的流并终止仍在运行的进程
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+    selector.close()
+
+    for p in processes:
+        if 'exit_code' not in p:
+            if p['process'].poll() is None:
+                p['process'].terminate()
+            try:
+                p['exit_code'] = p['process'].wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                p['process'].kill()
+                p['exit_code'] = p['process'].wait()
+            if verbose:
+                print(f"进程 {p['index']} ({' '.join(p['cmd'])}) 被终止，返回码: {p['exit_code']}")
+
+    return processes
+
+
+# 测试同时监控多个进程
+commands = [
+    ['bash', '-c', 'for i in {1..3}; do echo "Process 1: $i"; sleep 1; done'],
+    ['bash', '-c', 'for i in {1..5}; do echo "Process 2: $i"; sleep 0.5; done'],
+    ['bash', '-c', 'for i in {1..2}; do echo "Process 3: $i"; echo "Error in 3" >&2; sleep 1; done']
+]
+
+print("开始监控多个进程:")
+results = monitor_multiple_processes(commands)
+
+# 打印汇总信息
+print("\n结果汇总:")
+for p in results:
+    print(f"进程 {p['index']} ({' '.join(p['cmd'])}):")
+    print(f"  返回码: {p['exit_code']}")
+    print(f"  stdout 行数: {len(p['stdout_lines'])}")
+    print(f"  stderr 行数: {len(p['stderr_lines'])}")
+
+# 大量子进程: 超过 FD_SETSIZE (1024) 个文件描述符时 select 会失败
+# 注意: 需要 ulimit -n 大于 2 * n
+n = 600
+many_commands = [['bash', '-c', f'echo "job {i}"; sleep 0.2; echo "done {i}"'] for i in range(n)]
+start = time.perf_counter()
+results = monitor_multiple_processes(many_commands, verbose=False)
+elapsed = time.perf_counter() - start
+total_lines = sum(len(p['stdout_lines']) for p in results)
+print(f"\n监控 {n} 个子进程 ({2 * n} 个文件描述符) 耗时 {elapsed:.2f} 秒, 共 {total_lines} 行输出")
+
+# 关闭了输出但仍在运行的进程也受 timeout 限制
+start = time.perf_counter()
+results = monitor_multiple_processes([['bash', '-c', 'exec >&- 2>&-; sleep 6']], timeout=1, verbose=False)
+print(f"关闭输出后 sleep 6: {time.perf_counter() - start:.2f} 秒后返回, 返回码 {results[0]['exit_code']}")
@@ -0,0 +1,173 @@
+"""
+所有子进程共用一个读线程的实时输出中心
+06-monitoring-process.py 为每个子进程启动两个线程 (stdout/stderr)，
+500 个子进程就是 1000 个线程；这里无论多少子进程都只有一个 I/O 线程
+同一个流内的行顺序与原实现一致，返回码同样来自 process.wait()
+"""
+import os
+import queue
+import selectors
+import subprocess
+import threading
+import time
+import traceback
+
+CHUNK_SIZE = 65536
+
+
+class OutputHub:
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = queue.Queue()  # 等待注册的流
+        # 用管道唤醒阻塞在 select 上的 I/O 线程
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, process, callback):
+        """注册一个 Popen 对象，返回其所有输出读完时被设置的 Event"""
+        done = threading.Event()
+        state = {'open_streams': 0, 'done': done}
+        for stream_name in ('stdout', 'stderr'):
+            stream = getattr(process, stream_name)
+            if stream is not None:
+                state['open_streams'] += 1
+                self.pending.put((stream, stream_name, callback, state))
+        if state['open_streams'] == 0:
+            done.set()
+        os.write(self.wakeup_w, b'\0')
+        return done
+
+    def close(self):
+        """停止 I/O 线程"""
+        self.closed = True
+        os.write(self.wakeup_w, b'\0')
+        self.thread.join()
+        self.selector.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+    def _register_pending(self):
+        while True:
+            try:
+                stream, stream_name, callback, state = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            os.set_blocking(stream.fileno(), False)
+            # data: [流名称, 回调, 共享状态, 尚未凑成整行的残余数据]
+            self.selector.register(stream, selectors.EVENT_READ,
+                                   [stream_name, callback, state, b''])
+
+    @staticmethod
+    def _deliver(callback, stream_name, line):
+        """调用用户回调，回调抛出的异常只打印出来，不能让唯一的 I/O 线程退出"""
+        try:
+            callback(stream_name, line)
+        except Exception:
+            traceback.print_exc()
+
+    def _run(self):
+        while not self.closed:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    os.read(self.wakeup_r, CHUNK_SIZE)
+                    self._register_pending()
+                    continue
+
+                stream_name, callback, state, pending = key.data
+                try:
+                    chunk = os.read(key.fd, CHUNK_SIZE)
+                except BlockingIOError:
+                    continue
+
+                if not chunk:
+                    # EOF: 交付残余的半行，注销该流
+                    if pending:
+                        self._deliver(callback, stream_name, pending.decode(errors='replace'))
+                    self.selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    state['open_streams'] -= 1
+                    if state['open_streams'] == 0:
+                        state['done'].set()
+                    continue
+
+                lines = (pending + chunk).split(b'\n')
+                key.data[3] = lines.pop()
+                for line in lines:
+                    self._deliver(callback, stream_name, line.decode(errors='replace'))
+
+
+def print_output(stream_name, line):
+    """默认回调: 与 stream_output 的打印格式一致"""
+    print(f"{stream_name}: {line.strip()}")
+
+
+def run_with_live_output(cmd, hub, callback=print_output):
+    """运行命令并实时显示输出，输出由共享的 hub 读取"""
+    process = subprocess.Popen(cmd,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    done = hub.add(process, callback)
+
+    # 等待进程完成
+    return_code = process.wait()
+
+    # 等待输出全部读完
+    done.wait()
+
+    return return_code
+
+
+# 测试实时输出
+hub = OutputHub()
+
+print("运行命令并实时显示输出:")
+return_code = run_with_live_output(['bash', '-c',
+                                    'for i in {1..5}; do echo "Line $i"; sleep 1; done; echo "Error line" >&2'],
+                                   hub)
+print(f"命令结束，返回码: {return_code}")
+
+
+# 回调抛出异常: 异常被打印，进程仍然被标记为完成，之后的输出照常分发
+def broken_callback(stream_name, line):
+    raise ValueError(f"回调出错: {line}")
+
+
+return_code = run_with_live_output(['echo', 'boom'], hub, broken_callback)
+print(f"回调出错的命令返回码: {return_code}")
+return_code = run_with_live_output(['echo', 'still working'], hub)
+print(f"之后的命令返回码: {return_code}")
+
+# 多个子进程并发运行，仍然只有一个 I/O 线程
+n = 500
+counts = {'stdout': 0, 'stderr': 0}
+lock = threading.Lock()
+
+
+def count_output(stream_name, line):
+    with lock:
+        counts[stream_name] += 1
+
+
+start = time.perf_counter()
+processes = []
+for i in range(n):
+    process = subprocess.Popen(['bash', '-c', f'echo "out {i}"; echo "err {i}" >&2; exit {i % 3}'],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    processes.append((process, hub.add(process, count_output)))
+
+return_codes = []
+for process, done in processes:
+    return_codes.append(process.wait())
+    done.wait()
+elapsed = time.perf_counter() - start
+
+print(f"\n{n} 个子进程耗时 {elapsed:.2f} 秒, 活动线程数: {threading.active_count()}")
+print(f"stdout 行数: {counts['stdout']}, stderr 行数: {counts['stderr']}, "
+      f"非零返回码: {sum(1 for rc in return_codes if rc != 0)}")
+
+hub.close()
@@ -0,0 +1,135 @@
+"""
+不使用 preexec_fn 的资源限制启动方式
+preexec_fn 会让 CPython 退回到 fork+exec 的慢路径，并且在多线程程序中不安全
+这里改为由 util-linux 的 prlimit 命令在 exec 目标程序前设置限制，
+Popen 本身不带 preexec_fn，可以继续走 vfork/posix_spawn 快路径
+没有 prlimit 命令时，退回到启动后用 resource.prlimit 设置子进程的限制
+"""
+import resource
+import shutil
+import subprocess
+import time
+
+# 与 08-set-resource-limits.py 中的限制相同
+DEFAULT_LIMITS = {
+    resource.RLIMIT_CPU: (1, 1),  # CPU 时间 (秒)
+    resource.RLIMIT_AS: (100 * 1024 * 1024, 100 * 1024 * 1024),  # 内存 (字节)
+    resource.RLIMIT_NPROC: (5, 5),  # 进程数
+}
+
+# prlimit 命令的参数名
+PRLIMIT_OPTIONS = {
+    resource.RLIMIT_CPU: '--cpu',
+    resource.RLIMIT_AS: '--as',
+    resource.RLIMIT_NPROC: '--nproc',
+}
+
+PRLIMIT = shutil.which('prlimit')
+
+
+def set_resource_limits():
+    """preexec_fn 版本，用于对比"""
+    for limit, value in DEFAULT_LIMITS.items():
+        resource.setrlimit(limit, value)
+
+
+def prlimit_command(cmd, limits=DEFAULT_LIMITS):
+    """用 prlimit 包装命令，由 prlimit 设置限制后再 exec 目标程序"""
+    options = [f'{PRLIMIT_OPTIONS[limit]}={soft}:{hard}'
+               for limit, (soft, hard) in limits.items()]
+    return [PRLIMIT] + options + ['--'] + list(cmd)
+
+
+# 注意: 这个函数需要在 Linux 系统上运行
+def run_with_resource_limits(cmd, limits=DEFAULT_LIMITS):
+    """使用资源限制运行命令，不使用 preexec_fn"""
+    try:
+        if PRLIMIT:
+            process = subprocess.Popen(prlimit_command(cmd, limits),
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       text=True)
+        else:
+            # 启动后再设置限制: 子进程在设置生效前可能已经运行了很短的时间
+            process = subprocess.Popen(cmd,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       text=True)
+            for limit, value in limits.items():
+                resource.prlimit(process.pid, limit, value)
+        stdout, stderr = process.communicate()
+        return {
+            'returncode': process.returncode,
+            'stdout': stdout,
+            'stderr': stderr
+        }
+    except Exception as e:
+        return {
+            'error': str(e)
+        }
+
+
+def run_with_preexec_fn(cmd):
+    """08-set-resource-limits.py 中的实现，用于对比"""
+    try:
+        process = subprocess.Popen(cmd,
+                                   preexec_fn=set_resource_limits,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   text=True)
+        stdout, stderr = process.communicate()
+        return {
+            'returncode': process.returncode,
+            'stdout': stdout,
+            'stderr': stderr
+        }
+    except Exception as e:
+        return {
+            'error': str(e)
+        }
+
+
+# 测试资源限制
+print(f"prlimit 命令: {PRLIMIT}")
+result = run_with_resource_limits(['python', '-c',
+                                   'import time; print("Starting"); time.sleep(2); print("Finished")'])
+print(f"返回码: {result.get('returncode')}")
+print(f"标准输出: {result.get('stdout')}")
+print(f"标准错误: {result.get('stderr')}")
+print(f"错误: {result.get('error', 'None')}")
+
+# 确认限制已经生效: CPU 时间超过 1 秒会被信号终止 (软硬限制相同时为 SIGKILL)
+result = run_with_resource_limits(['python', '-c', 'while True: pass'])
+print(f"死循环返回码: {result.get('returncode')} (负数表示被信号终止)")
+
+result = run_with_resource_limits(['bash', '-c', 'ulimit -t; ulimit -v; ulimit -u'])
+print(f"子进程看到的限制 (cpu/as KB/nproc): {result.get('stdout').split()}")
+
+# 每秒启动次数对比
+n = 500
+start = time.perf_counter()
+for _ in range(n):
+    run_with_preexec_fn(['true'])
+elapsed = time.perf_counter() - start
+print(f"\npreexec_fn: {n / elapsed:.0f} 次/秒")
+
+start = time.perf_counter()
+for _ in range(n):
+    run_with_resource_limits(['true'])
+elapsed = time.perf_counter() - start
+print(f"prlimit 包装: {n / elapsed:.0f} 次/秒")
+
+# 父进程较大时差距更明显: fork 需要复制页表，vfork 不需要
+ballast = bytearray(512 * 1024 * 1024)
+start = time.perf_counter()
+for _ in range(n):
+    run_with_preexec_fn(['true'])
+elapsed = time.perf_counter() - start
+print(f"\n父进程占用 512MB 时 preexec_fn: {n / elapsed:.0f} 次/秒")
+
+start = time.perf_counter()
+for _ in range(n):
+    run_with_resource_limits(['true'])
+elapsed = time.perf_counter() - start
+print(f"父进程占用 512MB 时 prlimit 包装: {n / elapsed:.0f} 次/秒")
+del ballast
@@ -0,0 +1,257 @@
+"""
+预热的 Python 解释器池，用来代替每个任务都启动一次 python -c
+工作进程由 multiprocessing 的 forkserver 创建，常用模块提前导入
+每个任务在工作进程中 fork 出一个子进程执行，在子进程里设置资源限制，
+因此限制只作用于该任务，不会影响工作进程本身
+返回结构与 08-set-resource-limits.py 中的 run_with_resource_limits 一致
+工作进程执行 max_jobs 个任务后会被回收并重新创建
+注意: 需要在 Unix/Linux 系统上运行
+"""
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+# 与 08-set-resource-limits.py 中的限制相同
+DEFAULT_LIMITS = {
+    resource.RLIMIT_CPU: (1, 1),
+    resource.RLIMIT_AS: (100 * 1024 * 1024, 100 * 1024 * 1024),
+    resource.RLIMIT_NPROC: (5, 5),
+}
+
+
+def _run_job(job, limits):
+    """在 fork 出的子进程中执行任务，返回退出码"""
+    for limit, value in limits.items():
+        resource.setrlimit(limit, value)
+    try:
+        if isinstance(job, str):
+            exec(compile(job, '<string>', 'exec'), {'__name__': '__main__'})
+        else:
+            func, args = job
+            func(*args)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def _worker(conn):
+    """工作进程主循环: 接收任务，fork 子进程执行，收集输出和返回码"""
+    stdout_file = tempfile.TemporaryFile()
+    stderr_file = tempfile.TemporaryFile()
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        job, limits = message
+
+        for f in (stdout_file, stderr_file):
+            f.seek(0)
+            f.truncate()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            # 子进程: 把 stdout/stderr 重定向到临时文件
+            os.dup2(stdout_file.fileno(), 1)
+            os.dup2(stderr_file.fileno(), 2)
+            code = _run_job(job, limits)
+            os._exit(code & 0xff)
+
+        conn.send(pid)  # 超时时调用方据此结束任务
+        _, status = os.waitpid(pid, 0)
+        # 与 Popen.returncode 相同: 被信号终止时为负数
+        returncode = os.waitstatus_to_exitcode(status)
+
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        conn.send({
+            'returncode': returncode,
+            'stdout': stdout_file.read().decode(errors='replace'),
+            'stderr': stderr_file.read().decode(errors='replace')
+        })
+
+
+class WarmPythonPool:
+    def __init__(self, size=4, max_jobs=100, preload=('json', 're', 'time')):
+        self.ctx = multiprocessing.get_context('forkserver')
+        # forkserver 进程提前导入这些模块，之后创建的工作进程都直接继承
+        self.ctx.set_forkserver_preload(list(preload))
+        self.max_jobs = max_jobs
+        self.idle = queue.Queue()
+        self.workers = []
+        for _ in range(size):
+            self.idle.put(self._start_worker())
+
+    def _start_worker(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(target=_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker = {'process': process, 'conn': parent_conn, 'jobs': 0}
+        self.workers.append(worker)
+        return worker
+
+    def _stop_worker(self, worker):
+        try:
+            worker['conn'].send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        worker['conn'].close()
+        worker['process'].join(timeout=2)
+        if worker['process'].is_alive():
+            worker['process'].kill()
+            worker['process'].join()
+        self.workers.remove(worker)
+
+    def run(self, job, *args, limits=DEFAULT_LIMITS, timeout=None):
+        """执行一段代码字符串或一个可调用对象，可以在多个线程中并发调用
+        超过 timeout 秒时结束任务，并换掉执行它的工作进程，避免挂起的任务长期占用工作进程"""
+        if not isinstance(job, str):
+            job = (job, args)
+        worker = self.idle.get()
+        try:
+            worker['conn'].send((job, limits))
+            pid = worker['conn'].recv()
+            if timeout is not None and not worker['conn'].poll(timeout):
+                self._kill_job(worker, pid)
+                return {
+                    'error': f"任务执行超时: {timeout}秒"
+                }
+            result = worker['conn'].recv()
+            worker['jobs'] += 1
+        except Exception as e:
+            # 工作进程异常退出，换一个新的
+            self._stop_worker(worker)
+            self.idle.put(self._start_worker())
+            return {
+                'error': str(e)
+            }
+
+        # 执行足够多的任务后回收工作进程
+        if worker['jobs'] >= self.max_jobs:
+            self._stop_worker(worker)
+            worker = self._start_worker()
+        self.idle.put(worker)
+        return result
+
+    def _kill_job(self, worker, pid):
+        """结束超时的任务子进程，等工作进程回收它之后换一个新的工作进程"""
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        if worker['conn'].poll(2):
+            worker['conn'].recv()
+        self._stop_worker(worker)
+        self.idle.put(self._start_worker())
+
+    def close(self):
+        for worker in list(self.workers):
+            self._stop_worker(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def greet(name):
+    print(f"Hello, {name}!")
+
+
+def run_with_resource_limits(cmd):
+    """08-set-resource-limits.py 中的实现，用于对比"""
+    def set_resource_limits():
+        for limit, value in DEFAULT_LIMITS.items():
+            resource.setrlimit(limit, value)
+
+    try:
+        process = subprocess.Popen(cmd,
+                                   preexec_fn=set_resource_limits,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   text=True)
+        stdout, stderr = process.communicate()
+        return {
+            'returncode': process.returncode,
+            'stdout': stdout,
+            'stderr': stderr
+        }
+    except Exception as e:
+        return {
+            'error': str(e)
+        }
+
+
+if __name__ == '__main__':
+    # forkserver 会重新导入主模块，测试代码需要放在 __main__ 保护下
+    with WarmPythonPool(size=2, max_jobs=50) as pool:
+        result = pool.run('import time; print("Starting"); time.sleep(2); print("Finished")')
+        print(f"返回码: {result.get('returncode')}")
+        print(f"标准输出: {result.get('stdout')}")
+        print(f"标准错误: {result.get('stderr')}")
+        print(f"错误: {result.get('error', 'None')}")
+
+        # 可调用对象
+        result = pool.run(greet, 'pool')
+        print(f"可调用对象输出: {result['stdout'].strip()}")
+
+        # 异常和退出码
+        result = pool.run('import sys; print("bad", file=sys.stderr); sys.exit(3)')
+        print(f"sys.exit(3) 返回码: {result['returncode']}, 标准错误: {result['stderr'].strip()}")
+
+        # 资源限制对每个任务生效: CPU 时间超限被终止
+        result = pool.run('while True: pass')
+        print(f"死循环返回码: {result['returncode']} (负数表示被信号终止)")
+
+        # 内存超限
+        result = pool.run('x = bytearray(200 * 1024 * 1024)')
+        print(f"申请 200MB 返回码: {result['returncode']}, "
+              f"标准错误最后一行: {result['stderr'].strip().splitlines()[-1]}")
+
+        # 任务超时: 结束任务并换掉工作进程，池中的工作进程数不变
+        start = time.perf_counter()
+        result = pool.run('import time; time.sleep(30)', timeout=1)
+        print(f"挂起的任务: {result.get('error')}, 耗时 {time.perf_counter() - start:.2f} 秒, "
+              f"工作进程数 {len(pool.workers)}")
+        print(f"之后的任务: {pool.run('print(1 + 1)', timeout=1)['stdout'].strip()}")
+
+        # 单个任务延迟对比
+        n = 100
+        snippet = 'import json; print(json.dumps({"ok": True}))'
+        start = time.perf_counter()
+        for _ in range(n):
+            run_with_resource_limits([sys.executable, '-c', snippet])
+        cold = (time.perf_counter() - start) / n
+        print(f"\n每次启动 python -c: 平均 {cold * 1000:.2f} 毫秒/任务")
+
+        start = time.perf_counter()
+        for _ in range(n):
+            pool.run(snippet)
+        warm = (time.perf_counter() - start) / n
+        print(f"预热解释器池: 平均 {warm * 1000:.2f} 毫秒/任务 (含工作进程回收)")
+        print(f"加速比: {cold / warm:.1f}x")
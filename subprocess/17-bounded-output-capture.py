@@ -0,0 +1,233 @@
+"""
+内存占用有上限的输出捕获
+capture_output=True 会把全部输出读进内存再一次性解码，输出很大时会占用数 GB 内存
+这里输出先写入内存缓冲区，超过上限后转存到临时文件，可以用 mmap 访问
+同时保留开头和结尾两段数据，作为输出预览 (stdout_preview/stderr_preview)
+stdout/stderr 与 04-user-defined-except-process.py 一样是完整输出，在命令结束后才解码；
+decode=False 时不解码，完整输出通过 stdout_buffer 的 iter_chunks/iter_lines 按需流式读取
+"""
+import mmap
+import os
+import selectors
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+CHUNK_SIZE = 65536
+
+
+class SpillBuffer:
+    def __init__(self, max_memory=1024 * 1024, head_size=4096, tail_size=4096):
+        self.max_memory = max_memory
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.memory = bytearray()
+        self.file = None  # 超过上限后使用的临时文件
+        self.head = bytearray()
+        self.tail = bytearray()  # 只保留最后 tail_size 字节
+        self.size = 0
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def write(self, data):
+        self.size += len(data)
+        if len(self.head) < self.head_size:
+            self.head += data[:self.head_size - len(self.head)]
+        self.tail += data
+        if len(self.tail) > self.tail_size:
+            del self.tail[:len(self.tail) - self.tail_size]
+
+        if self.file is None and len(self.memory) + len(data) > self.max_memory:
+            # 超过内存上限: 把已有数据转存到临时文件
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self.memory)
+            self.memory = bytearray()
+        if self.file is None:
+            self.memory += data
+        else:
+            self.file.write(data)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """流式读取完整输出"""
+        if self.file is None:
+            view = memoryview(self.memory)
+            for i in range(0, len(view), chunk_size):
+                yield bytes(view[i:i + chunk_size])
+            return
+        self.file.flush()
+        offset = 0
+        while True:
+            chunk = os.pread(self.file.fileno(), chunk_size, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def iter_lines(self, encoding='utf-8'):
+        """按行流式读取并解码完整输出"""
+        pending = b''
+        for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode(encoding, errors='replace')
+        if pending:
+            yield pending.decode(encoding, errors='replace')
+
+    def mmap(self):
+        """返回完整输出的只读视图，转存到文件时为 mmap，否则为 bytes"""
+        if self.file is None or self.size == 0:
+            return bytes(self.memory)
+        self.file.flush()
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def text(self, encoding='utf-8'):
+        """解码完整输出"""
+        if self.file is None or self.size == 0:
+            return self.memory.decode(encoding, errors='replace')
+        with self.mmap() as m:
+            return str(m, encoding, errors='replace')
+
+    def preview(self, encoding='utf-8'):
+        """开头和结尾的预览，数据不多时就是完整输出"""
+        if self.size <= self.head_size + self.tail_size and not self.spilled:
+            return self.memory.decode(encoding, errors='replace')
+        if self.size <= self.head_size + self.tail_size:
+            return b''.join(self.iter_chunks()).decode(encoding, errors='replace')
+        omitted = self.size - len(self.head) - len(self.tail)
+        return (self.head.decode(encoding, errors='replace')
+                + f"\n... [省略 {omitted} 字节] ...\n"
+                + self.tail.decode(encoding, errors='replace'))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.memory = bytearray()
+
+
+def capture(process, buffers, timeout=None):
+    """把子进程的 stdout/stderr 读入对应的 SpillBuffer，超时返回 False"""
+    selector = selectors.DefaultSelector()
+    for stream, buffer in zip((process.stdout, process.stderr), buffers):
+        selector.register(stream, selectors.EVENT_READ, buffer)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while selector.get_map():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, CHUNK_SIZE)
+                if chunk:
+                    key.data.write(chunk)
+                else:
+                    selector.unregister(key.fileobj)
+    finally:
+        selector.close()
+    return True
+
+
+def execute_command(cmd, timeout=None, max_memory=1024 * 1024, decode=True):
+    """执行命令并提供友好的错误处理，捕获期间输出占用的内存有上限
+    decode=False 时结果中没有 stdout/stderr，完整输出从 stdout_buffer/stderr_buffer 读取"""
+    stdout_buffer = SpillBuffer(max_memory)
+    stderr_buffer = SpillBuffer(max_memory)
+
+    def output(**result):
+        result['stdout_preview'] = stdout_buffer.preview()
+        result['stderr_preview'] = stderr_buffer.preview()
+        if decode:
+            result['stdout'] = stdout_buffer.text()
+            result['stderr'] = stderr_buffer.text()
+        result['stdout_buffer'] = stdout_buffer
+        result['stderr_buffer'] = stderr_buffer
+        return result
+
+    try:
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        with process:
+            if not capture(process, (stdout_buffer, stderr_buffer), timeout):
+                process.kill()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            returncode = process.wait()
+
+        if returncode != 0:
+            return output(success=False,
+                          error=f"命令返回非零状态码: {returncode}",
+                          returncode=returncode,
+                          error_type='non_zero_exit')
+        return output(success=True, returncode=returncode)
+    except FileNotFoundError:
+        stdout_buffer.close()
+        stderr_buffer.close()
+        return {
+            'success': False,
+            'error': f"找不到命令: {cmd[0]}",
+            'error_type': 'command_not_found'
+        }
+    except subprocess.TimeoutExpired:
+        result = {
+            'success': False,
+            'error': f"命令执行超时: {timeout}秒",
+            'stdout': stdout_buffer.text(),
+            'stderr': stderr_buffer.text(),
+            'error_type': 'timeout'
+        }
+        stdout_buffer.close()
+        stderr_buffer.close()
+        return result
+    except Exception as e:
+        stdout_buffer.close()
+        stderr_buffer.close()
+        return {
+            'success': False,
+            'error': f"执行命令时发生未知错误: {e}",
+            'error_type': 'unknown'
+        }
+
+
+# 测试
+result = execute_command(['ls', '-l'])
+if result['success']:
+    print(f"命令输出:\n{result['stdout']}")
+else:
+    print(f"错误: {result['error']}")
+
+result = execute_command(['ls', 'non_existent_file'])
+print(f"错误: {result['error']}, 标准错误: {result['stderr'].strip()}")
+
+result = execute_command(['bash', '-c', 'echo "partial output"; sleep 5'], timeout=1)
+print(f"错误: {result['error']}, 超时前的输出: {result['stdout'].strip()}")
+
+# 输出很大的命令: 内存占用保持不变
+tracemalloc.start()
+result = execute_command(['bash', '-c', 'seq 1 20000000'], max_memory=1024 * 1024, decode=False)
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+stdout_buffer = result['stdout_buffer']
+print(f"\n输出大小: {stdout_buffer.size / 1024 / 1024:.1f} MB, 已转存到文件: {stdout_buffer.spilled}")
+print(f"捕获期间 Python 内存峰值: {peak / 1024 / 1024:.1f} MB")
+print(f"预览:\n{result['stdout_preview'][:40]}...{result['stdout_preview'][-40:]}")
+
+# 流式访问完整输出
+line_count = sum(1 for _ in stdout_buffer.iter_lines())
+print(f"逐行读取: {line_count} 行")
+
+# 用 mmap 随机访问
+m = stdout_buffer.mmap()
+first_newline = m.find(b'\n')
+print(f"mmap 中第一个换行符的位置: {first_newline}, 最后 8 字节: {m[-8:]}")
+m.close()
+
+stdout_buffer.close()
+result['stderr_buffer'].close()
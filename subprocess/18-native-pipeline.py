@@ -0,0 +1,220 @@
+"""
+多阶段管道: cmd1 | cmd2 | cmd3
+前一个子进程的 stdout 直接接到下一个子进程的 stdin，数据不经过 Python
+Python 只在两端处理数据: 写入第一个阶段的输入，读取最后一个阶段的输出
+输出写入文件时可以使用 os.splice，在内核中直接从管道搬运到文件
+每个阶段的返回码和 stderr 单独报告
+"""
+import os
+import selectors
+import subprocess
+import tempfile
+import time
+
+CHUNK_SIZE = 65536
+
+
+class Command:
+    def __init__(self, *argv):
+        self.argv = list(argv)
+
+    def __or__(self, other):
+        return Pipeline([self]) | other
+
+    def __repr__(self):
+        return ' '.join(self.argv)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+
+    def __or__(self, other):
+        if isinstance(other, Pipeline):
+            return Pipeline(self.stages + other.stages)
+        return Pipeline(self.stages + [other])
+
+    def __repr__(self):
+        return ' | '.join(repr(stage) for stage in self.stages)
+
+    def _start(self, stdin, stdout):
+        """依次启动所有阶段，相邻阶段之间直接用管道连接
+        某个阶段启动失败 (如命令不存在) 时记为 None，与 shell 一样继续启动后面的阶段:
+        它的上游收到 SIGPIPE，下游从 /dev/null 读到 EOF"""
+        processes = []
+        errors = {}
+        first_stdin = None
+        try:
+            for i, stage in enumerate(self.stages):
+                last = i == len(self.stages) - 1
+                try:
+                    process = subprocess.Popen(stage.argv,
+                                               stdin=stdin,
+                                               stdout=stdout if last else subprocess.PIPE,
+                                               stderr=subprocess.PIPE)
+                except OSError as e:
+                    process = None
+                    errors[i] = e
+                if i > 0 and processes[-1] is not None:
+                    # 父进程关闭自己持有的管道读端，下游退出时上游才能收到 SIGPIPE
+                    processes[-1].stdout.close()
+                if i == 0 and process is not None:
+                    first_stdin = process.stdin
+                stdin = process.stdout if process is not None else subprocess.DEVNULL
+                processes.append(process)
+        except BaseException:
+            # 其他错误: 清理已经启动的阶段
+            for process in processes:
+                if process is not None:
+                    process.kill()
+                    process.communicate()
+            raise
+        return processes, first_stdin, errors
+
+    def run(self, input=None, stdout_file=None, text=True):
+        """运行整个管道，返回每个阶段的返回码和 stderr"""
+        if isinstance(input, str):
+            input = input.encode()
+
+        # 输入是文件对象时直接交给第一个阶段
+        if input is None or hasattr(input, 'fileno'):
+            stdin = input
+        else:
+            stdin = subprocess.PIPE
+
+        processes, first_stdin, errors = self._start(stdin, subprocess.PIPE)
+        started = [process for process in processes if process is not None]
+
+        selector = selectors.DefaultSelector()
+        for process in started:
+            selector.register(process.stderr, selectors.EVENT_READ, ('stderr', process))
+        if processes[-1] is not None:
+            selector.register(processes[-1].stdout, selectors.EVENT_READ, ('stdout', None))
+
+        input_view = None
+        if first_stdin is not None:
+            input_view = memoryview(input)
+            os.set_blocking(first_stdin.fileno(), False)
+            selector.register(first_stdin, selectors.EVENT_WRITE, ('stdin', None))
+
+        out_fd = None
+        if stdout_file is not None:
+            out_fd = os.open(stdout_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        stdout_chunks = []
+        stderr_chunks = {process.pid: [] for process in started}
+        stdout_bytes = 0
+
+        try:
+            while selector.get_map():
+                for key, _ in selector.select():
+                    kind, process = key.data
+                    if kind == 'stdin':
+                        try:
+                            written = os.write(key.fd, input_view[:CHUNK_SIZE])
+                        except BrokenPipeError:
+                            written = len(input_view)
+                        input_view = input_view[written:]
+                        if not input_view:
+                            selector.unregister(key.fileobj)
+                            key.fileobj.close()
+                        continue
+
+                    if kind == 'stdout' and out_fd is not None:
+                        # 管道到文件: 数据不进入用户空间
+                        if hasattr(os, 'splice'):
+                            count = os.splice(key.fd, out_fd, CHUNK_SIZE * 16)
+                        else:
+                            data = os.read(key.fd, CHUNK_SIZE)
+                            count = os.write(out_fd, data) if data else 0
+                        if count:
+                            stdout_bytes += count
+                            continue
+                        chunk = b''
+                    else:
+                        chunk = os.read(key.fd, CHUNK_SIZE)
+
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    elif kind == 'stdout':
+                        stdout_chunks.append(chunk)
+                        stdout_bytes += len(chunk)
+                    else:
+                        stderr_chunks[process.pid].append(chunk)
+        finally:
+            selector.close()
+            if out_fd is not None:
+                os.close(out_fd)
+
+        stages = []
+        for i, (stage, process) in enumerate(zip(self.stages, processes)):
+            if process is None:
+                # 与 shell 相同: 找不到命令为 127，无法执行为 126
+                returncode = 127 if isinstance(errors[i], FileNotFoundError) else 126
+                stderr = f"{errors[i]}\n".encode()
+            else:
+                returncode = process.wait()
+                stderr = b''.join(stderr_chunks[process.pid])
+            stages.append({
+                'cmd': stage.argv,
+                'returncode': returncode,
+                'stderr': stderr.decode(errors='replace') if text else stderr
+            })
+
+        stdout = b''.join(stdout_chunks)
+        return {
+            'success': all(stage['returncode'] == 0 for stage in stages),
+            'returncode': stages[-1]['returncode'],
+            'stdout': stdout.decode(errors='replace') if text else stdout,
+            'stdout_bytes': stdout_bytes,
+            'stages': stages
+        }
+
+
+# 通过 input 参数提供输入
+result = (Command('grep', 'hello') | Command('sort')).run(input="hello world\ngoodbye world\nhello again")
+print(f"匹配并排序: {result['stdout']}")
+
+# 每个阶段单独报告返回码和 stderr
+pipeline = Command('cat', 'non_existent_file') | Command('sort') | Command('wc', '-l')
+result = pipeline.run()
+print(f"\n{pipeline}")
+for stage in result['stages']:
+    print(f"  {' '.join(stage['cmd'])}: 返回码 {stage['returncode']}, stderr: {stage['stderr'].strip()!r}")
+
+# 中间阶段的命令不存在: 作为该阶段的结果报告，不抛出异常
+pipeline = Command('seq', '1', '100000') | Command('non_existent_command') | Command('wc', '-l')
+result = pipeline.run()
+print(f"\n{pipeline}")
+for stage in result['stages']:
+    print(f"  {' '.join(stage['cmd'])}: 返回码 {stage['returncode']}, stderr: {stage['stderr'].strip()!r}")
+
+# text=False 时也可以传入 str
+result = (Command('cat') | Command('tr', 'a-z', 'A-Z')).run(input="bytes mode\n", text=False)
+print(f"\ntext=False: {result['stdout']!r}")
+
+# 大数据量对比: 文本经过 Python 字符串 vs 直接在管道中流动
+with tempfile.TemporaryDirectory() as tmpdir:
+    data_path = os.path.join(tmpdir, 'data.txt')
+    with open(data_path, 'w') as f:
+        subprocess.run(['seq', '1', '5000000'], stdout=f)
+    size = os.path.getsize(data_path)
+
+    start = time.perf_counter()
+    with open(data_path) as f:
+        data = f.read()
+    stdout = subprocess.run(['grep', '7'], input=data, capture_output=True, text=True).stdout
+    stdout = subprocess.run(['sort', '-r'], input=stdout, capture_output=True, text=True).stdout
+    stdout = subprocess.run(['cut', '-c1-3'], input=stdout, capture_output=True, text=True).stdout
+    elapsed = time.perf_counter() - start
+    print(f"\n经过 Python 字符串: {size / 1024 / 1024:.1f} MB 输入, 耗时 {elapsed:.2f} 秒")
+
+    pipeline = Command('grep', '7') | Command('sort', '-r') | Command('cut', '-c1-3')
+    out_path = os.path.join(tmpdir, 'out.txt')
+    start = time.perf_counter()
+    with open(data_path, 'rb') as f:
+        result = pipeline.run(input=f, stdout_file=out_path)
+    elapsed = time.perf_counter() - start
+    print(f"原生管道 + splice: 耗时 {elapsed:.2f} 秒, 写入 {result['stdout_bytes']} 字节, "
+          f"结果一致: {open(out_path).read() == stdout}")
@@ -0,0 +1,263 @@
+"""
+幂等命令的结果缓存 (按需启用)
+缓存键由 runner 对象、argv、cwd、环境变量 (env 参数或选定的环境变量)、stdin 的哈希
+以及其余执行参数 (timeout 等) 组成
+返回的是缓存结果的副本，调用方修改结果不会影响缓存
+支持 TTL 过期、LRU 容量上限，以及依据文件 mtime 失效
+多个线程同时请求同一个命令时只启动一个子进程，其余请求等待同一个结果
+"""
+import concurrent.futures
+import copy
+import hashlib
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def execute_command(cmd, timeout=None, input=None, cwd=None, env=None):
+    """执行命令并提供友好的错误处理"""
+    try:
+        result = subprocess.run(cmd,
+                                input=input,
+                                cwd=cwd,
+                                env=env,
+                                capture_output=True,
+                                text=True,
+                                check=True,
+                                timeout=timeout)
+        return {
+            'success': True,
+            'stdout': result.stdout,
+            'stderr': result.stderr,
+            'returncode': result.returncode
+        }
+    except FileNotFoundError:
+        return {
+            'success': False,
+            'error': f"找不到命令: {cmd[0]}",
+            'error_type': 'command_not_found'
+        }
+    except subprocess.CalledProcessError as e:
+        return {
+            'success': False,
+            'error': f"命令返回非零状态码: {e.returncode}",
+            'stdout': e.stdout,
+            'stderr': e.stderr,
+            'returncode': e.returncode,
+            'error_type': 'non_zero_exit'
+        }
+    except subprocess.TimeoutExpired:
+        return {
+            'success': False,
+            'error': f"命令执行超时: {timeout}秒",
+            'error_type': 'timeout'
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"执行命令时发生未知错误: {e}",
+            'error_type': 'unknown'
+        }
+
+
+def run_command(cmd, input=None, cwd=None, env=None):
+    """执行单个命令并返回结果"""
+    try:
+        result = subprocess.run(cmd,
+                                input=input,
+                                cwd=cwd,
+                                env=env,
+                                capture_output=True,
+                                text=True,
+                                check=True)
+        return {
+            'cmd': cmd,
+            'success': True,
+            'output': result.stdout
+        }
+    except Exception as e:
+        return {
+            'cmd': cmd,
+            'success': False,
+            'error': str(e)
+        }
+
+
+def get_platform_specific_command(cmd_type):
+    """获取跨平台命令"""
+    commands = {
+        'list_dir': {
+            'win32': ['dir'],
+            'default': ['ls', '-la']
+        },
+        'list_processes': {
+            'win32': ['tasklist'],
+            'darwin': ['ps', '-ax'],
+            'default': ['ps', '-ef']
+        },
+        'find_file': {
+            'win32': ['where'],
+            'default': ['which']
+        }
+    }
+
+    platform_cmds = commands.get(cmd_type, {})
+    return platform_cmds.get(sys.platform, platform_cmds.get('default', []))
+
+
+class CommandCache:
+    def __init__(self, ttl=60, max_entries=1024, env_keys=('PATH', 'LANG')):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.env_keys = env_keys  # 参与缓存键计算的环境变量
+        self.entries = OrderedDict()  # key -> (过期时间, 文件 mtime 快照, 结果)
+        self.in_flight = {}  # key -> Future，用于合并并发的相同请求
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, cmd, runner=execute_command, cwd=None, input=None, **kwargs):
+        """由 runner 对象、argv、cwd、环境变量、stdin 哈希和其余执行参数生成缓存键
+        runner 按对象本身区分，名字相同的不同函数 (例如两个 lambda) 不会共用缓存"""
+        h = hashlib.sha256()
+        for part in cmd:
+            h.update(part.encode() + b'\0')
+        h.update(b'\1' + os.path.abspath(cwd or os.getcwd()).encode())
+        env = kwargs.pop('env', None)
+        if env is None:
+            env = {name: os.environ.get(name, '') for name in self.env_keys}
+        for name, value in sorted(env.items()):
+            h.update(b'\1' + name.encode() + b'=' + value.encode())
+        if input is not None:
+            data = input.encode() if isinstance(input, str) else input
+            h.update(b'\1' + hashlib.sha256(data).digest())
+        h.update(b'\2' + repr(sorted(kwargs.items())).encode())
+        return runner, h.hexdigest()
+
+    @staticmethod
+    def snapshot(watch_paths):
+        """记录依赖文件的 mtime，不存在的文件记为 None"""
+        mtimes = []
+        for path in watch_paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return (tuple(watch_paths), tuple(mtimes))
+
+    def run(self, cmd, runner=execute_command, input=None, cwd=None, watch_paths=(), **kwargs):
+        """通过缓存执行命令，runner 可以是 execute_command 或 run_command"""
+        key = self.make_key(cmd, runner, cwd, input, **kwargs)
+        watch = self.snapshot(watch_paths)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, cached_watch, result = entry
+                if expires > time.monotonic() and cached_watch == watch:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(result)
+                del self.entries[key]
+
+            future = self.in_flight.get(key)
+            if future is not None:
+                # 相同的命令正在执行，等待它的结果
+                self.hits += 1
+                leader = False
+            else:
+                future = concurrent.futures.Future()
+                self.in_flight[key] = future
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = runner(cmd, input=input, cwd=cwd, **kwargs)
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            # 只缓存成功的结果
+            if result.get('success'):
+                self.entries[key] = (time.monotonic() + self.ttl, watch, result)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        future.set_result(result)
+        return copy.deepcopy(result)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+# 测试
+cache = CommandCache(ttl=30, max_entries=128)
+
+list_dir_cmd = get_platform_specific_command('list_dir')
+start = time.perf_counter()
+for _ in range(100):
+    subprocess.run(list_dir_cmd, capture_output=True, text=True)
+uncached = time.perf_counter() - start
+
+start = time.perf_counter()
+for _ in range(100):
+    result = cache.run(list_dir_cmd)
+cached = time.perf_counter() - start
+print(f"{list_dir_cmd} 执行 100 次: 不缓存 {uncached:.3f} 秒, 缓存 {cached:.3f} 秒")
+print(f"缓存统计: {cache.stats()}")
+
+# run_command 的结果结构同样可以缓存
+result = cache.run(get_platform_specific_command('find_file') + ['python3'], runner=run_command)
+print(f"\nwhich python3: {result['output'].strip()}")
+
+# 名字相同的不同 runner、不同的执行参数不会共用缓存
+runners = [lambda cmd, **kwargs: {'success': True, 'stdout': 'UPPER'},
+           lambda cmd, **kwargs: {'success': True, 'stdout': 'lower'}]
+print(f"两个 lambda: {' / '.join(cache.run(['true'], runner=runner)['stdout'] for runner in runners)}")
+a = cache.run(['printenv', 'DEMO'], env={'DEMO': 'a'})
+b = cache.run(['printenv', 'DEMO'], env={'DEMO': 'b'})
+print(f"不同的 env: {a['stdout'].strip()} / {b['stdout'].strip()}")
+
+# 修改返回的结果不影响缓存
+result = cache.run(['echo', 'cached'])
+result['stdout'] = 'modified'
+print(f"修改返回值后再次读取: {cache.run(['echo', 'cached'])['stdout'].strip()}")
+
+# stdin 不同，缓存键也不同
+a = cache.run(['sort'], input="b\na\n")
+b = cache.run(['sort'], input="d\nc\n")
+print(f"不同输入: {a['stdout']!r} / {b['stdout']!r}")
+
+# 依赖文件修改后缓存失效
+with open('cache-demo.txt', 'w') as f:
+    f.write('v1\n')
+first = cache.run(['cat', 'cache-demo.txt'], watch_paths=['cache-demo.txt'])
+time.sleep(0.01)
+with open('cache-demo.txt', 'w') as f:
+    f.write('v2\n')
+second = cache.run(['cat', 'cache-demo.txt'], watch_paths=['cache-demo.txt'])
+os.remove('cache-demo.txt')
+print(f"文件修改前: {first['stdout'].strip()}, 修改后: {second['stdout'].strip()}")
+
+# 并发的相同请求合并为一次执行
+cache.invalidate()
+before = cache.stats()['misses']
+with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
+    results = list(executor.map(lambda _: cache.run(['bash', '-c', 'sleep 0.5; date +%N']), range(20)))
+print(f"\n20 个并发请求, 实际启动 {cache.stats()['misses'] - before} 个子进程, "
+      f"不同结果数: {len({r['stdout'] for r in results})}")
@@ -0,0 +1,272 @@
+"""
+子进程资源统计
+进程结束时用 os.wait4 回收，得到该子进程的 rusage (用户/系统 CPU 时间、最大 RSS、上下文切换次数)
+可选地按固定间隔采样 /proc/<pid>/stat 和 statm，统计整个进程树的 CPU 和内存
+结果以结构化的 metrics 字典返回，方便找出批量命令中开销最大的那些
+注意: /proc 采样只在 Linux 上可用
+"""
+import os
+import selectors
+import subprocess
+import threading
+import time
+
+CHUNK_SIZE = 65536
+KILL_GRACE = 2  # 超时后 SIGTERM 到 SIGKILL 之间等待的秒数
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def reap(process, options=0):
+    """用 wait4 回收子进程，返回 rusage 统计并设置 process.returncode
+    options 为 os.WNOHANG 且子进程尚未结束时返回 None"""
+    pid, status, rusage = os.wait4(process.pid, options)
+    if pid == 0:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'user_time': rusage.ru_utime,
+        'system_time': rusage.ru_stime,
+        'max_rss_kb': rusage.ru_maxrss,  # Linux 上单位为 KB
+        'voluntary_ctx_switches': rusage.ru_nvcsw,
+        'involuntary_ctx_switches': rusage.ru_nivcsw,
+    }
+
+
+def process_tree(pid):
+    """返回 pid 及其所有后代进程的 pid"""
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        try:
+            with open(f'/proc/{pids[i]}/task/{pids[i]}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+        i += 1
+    return pids
+
+
+def read_proc(pid):
+    """读取单个进程的 CPU 时间 (秒) 和 RSS (字节)"""
+    with open(f'/proc/{pid}/stat', 'rb') as f:
+        stat = f.read()
+    # 进程名可能包含空格，从最后一个 ')' 之后开始解析
+    fields = stat[stat.rindex(b')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    with open(f'/proc/{pid}/statm', 'rb') as f:
+        rss = int(f.read().split()[1]) * PAGE_SIZE
+    return cpu, rss
+
+
+class ProcessSampler:
+    """后台线程按固定间隔采样一组进程树"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.targets = {}  # pid -> 采样结果
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, pid):
+        samples = {'samples': 0, 'peak_tree_rss_kb': 0, 'peak_tree_processes': 0, 'tree_cpu_time': 0.0}
+        with self.lock:
+            self.targets[pid] = samples
+        return samples
+
+    def remove(self, pid):
+        with self.lock:
+            return self.targets.pop(pid, None)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            with self.lock:
+                targets = list(self.targets.items())
+            for pid, samples in targets:
+                cpu = 0.0
+                rss = 0
+                pids = process_tree(pid)
+                for child in pids:
+                    try:
+                        child_cpu, child_rss = read_proc(child)
+                    except (OSError, ValueError, IndexError):
+                        continue  # 进程已经退出
+                    cpu += child_cpu
+                    rss += child_rss
+                samples['samples'] += 1
+                samples['peak_tree_rss_kb'] = max(samples['peak_tree_rss_kb'], rss // 1024)
+                samples['peak_tree_processes'] = max(samples['peak_tree_processes'], len(pids))
+                samples['tree_cpu_time'] = max(samples['tree_cpu_time'], cpu)
+
+
+def stream_output(process, stream_name):
+    """实时流式处理进程输出"""
+    stream = process.stdout if stream_name == 'stdout' else process.stderr
+    for line in iter(stream.readline, ''):
+        if not line:
+            break
+        print(f"{stream_name}: {line.strip()}")
+
+
+def run_with_live_output(cmd, sample_interval=None):
+    """运行命令并实时显示输出，返回返回码和资源统计"""
+    start = time.monotonic()
+    process = subprocess.Popen(cmd,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               text=True,
+                               bufsize=1)
+    sampler = ProcessSampler(sample_interval) if sample_interval else None
+    if sampler:
+        sampler.add(process.pid)
+
+    threads = [threading.Thread(target=stream_output, args=(process, name), daemon=True)
+               for name in ('stdout', 'stderr')]
+    for thread in threads:
+        thread.start()
+
+    # 用 wait4 代替 process.wait()，同时拿到 rusage
+    metrics = reap(process)
+    metrics['wall_time'] = time.monotonic() - start
+    if sampler:
+        metrics.update(sampler.remove(process.pid))
+        sampler.close()
+
+    for thread in threads:
+        thread.join()
+
+    return process.returncode, metrics
+
+
+def monitor_multiple_processes(commands, timeout=60, sample_interval=None, verbose=True):
+    """同时监控多个进程的输出，并统计每个进程的资源开销"""
+    selector = selectors.DefaultSelector()
+    sampler = ProcessSampler(sample_interval) if sample_interval else None
+    processes = []
+
+    for i, cmd in enumerate(commands):
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        p = {
+            'process': process,
+            'cmd': cmd,
+            'index': i,
+            'stdout_lines': [],
+            'stderr_lines': [],
+            'open_streams': 2,
+            'start_time': time.monotonic()
+        }
+        processes.append(p)
+        if sampler:
+            sampler.add(process.pid)
+        for stream_name, stream in (('stdout', process.stdout), ('stderr', process.stderr)):
+            selector.register(stream, selectors.EVENT_READ, [p, stream_name, b''])
+
+    # 输出已经关闭但进程还在运行时不能阻塞地 wait4，在循环中用 WNOHANG 检查
+    exiting = []
+
+    def on_exit(p, metrics):
+        p['metrics'] = metrics
+        p['metrics']['wall_time'] = time.monotonic() - p['start_time']
+        if sampler:
+            p['metrics'].update(sampler.remove(p['process'].pid))
+        p['exit_code'] = p['process'].returncode
+        if verbose:
+            print(f"进程 {p['index']} ({' '.join(p['cmd'])}) 已结束，返回码: {p['exit_code']}")
+
+    deadline = time.monotonic() + timeout
+    while selector.get_map() or exiting:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        for key, _ in selector.select(min(remaining, 0.05) if exiting else remaining):
+            p, stream_name, pending = key.data
+            chunk = os.read(key.fd, CHUNK_SIZE)
+            if not chunk:
+                if pending:
+                    p[f'{stream_name}_lines'].append(pending.decode(errors='replace').strip())
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                p['open_streams'] -= 1
+                if p['open_streams'] == 0:
+                    exiting.append(p)
+                continue
+            lines = (pending + chunk).split(b'\n')
+            key.data[2] = lines.pop()
+            for line in lines:
+                p[f'{stream_name}_lines'].append(line.decode(errors='replace').strip())
+
+        for p in exiting[:]:
+            metrics = reap(p['process'], os.WNOHANG)
+            if metrics is not None:
+                exiting.remove(p)
+                on_exit(p, metrics)
+
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+    selector.close()
+
+    # 超时: 先 SIGTERM，等待 KILL_GRACE 秒后仍未退出的进程 SIGKILL
+    running = [p for p in processes if 'exit_code' not in p]
+    for p in running:
+        p['process'].terminate()
+    grace_deadline = time.monotonic() + KILL_GRACE
+    while running:
+        for p in running[:]:
+            metrics = reap(p['process'], os.WNOHANG)
+            if metrics is not None:
+                running.remove(p)
+                on_exit(p, metrics)
+        if not running or time.monotonic() >= grace_deadline:
+            break
+        time.sleep(0.02)
+    for p in running:
+        p['process'].kill()
+        on_exit(p, reap(p['process']))
+
+    if sampler:
+        sampler.close()
+    return processes
+
+
+# 测试实时输出
+print("运行命令并实时显示输出:")
+return_code, metrics = run_with_live_output(['bash', '-c',
+                                             'for i in {1..3}; do echo "Line $i"; sleep 0.5; done; echo "Error line" >&2'],
+                                            sample_interval=0.1)
+print(f"命令结束，返回码: {return_code}")
+print(f"资源统计: {metrics}")
+
+# 找出一批命令中开销最大的
+commands = [
+    ['bash', '-c', 'sleep 1'],
+    ['python3', '-c', 'x = bytearray(200 * 1024 * 1024); sum(range(10 ** 7))'],
+    ['bash', '-c', 'for i in $(seq 200); do echo $i > /dev/null; done'],
+    ['bash', '-c', 'sleep 0.5 & sleep 0.5 & python3 -c "sum(range(10 ** 7))"; wait']
+]
+
+print("\n开始监控多个进程:")
+results = monitor_multiple_processes(commands, sample_interval=0.05)
+
+print("\n按 CPU 时间排序:")
+for p in sorted(results, key=lambda p: p['metrics']['user_time'] + p['metrics']['system_time'], reverse=True):
+    m = p['metrics']
+    print(f"进程 {p['index']} ({' '.join(p['cmd'])[:40]}):")
+    print(f"  CPU: 用户 {m['user_time']:.2f}s 系统 {m['system_time']:.2f}s, 墙钟 {m['wall_time']:.2f}s")
+    print(f"  最大 RSS: {m['max_rss_kb'] / 1024:.1f} MB, 上下文切换: "
+          f"{m['voluntary_ctx_switches']} 自愿 / {m['involuntary_ctx_switches']} 非自愿")
+    print(f"  采样 {m['samples']} 次, 进程树峰值 RSS {m['peak_tree_rss_kb'] / 1024:.1f} MB, "
+          f"峰值进程数 {m['peak_tree_processes']}")
+
+# 超时后忽略 SIGTERM 的进程在 KILL_GRACE 秒后被 SIGKILL
+start = time.perf_counter()
+results = monitor_multiple_processes([['bash', '-c', 'trap "" TERM; sleep 6']], timeout=1, verbose=False)
+print(f"\n忽略 SIGTERM 的进程: {time.perf_counter() - start:.2f} 秒后返回, 返回码 {results[0]['exit_code']}")
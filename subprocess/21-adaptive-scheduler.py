@@ -0,0 +1,187 @@
+"""
+根据系统负载自动调整并发数的批量执行调度器
+并发上限参考 CPU 核数、loadavg 和 /proc/loadavg 中可运行进程数 (运行队列压力)，
+压力大时成倍减少，空闲时逐个增加 (AIMD)
+任务按优先级分类，每类对应一个 nice 值，高优先级任务总是先出队，
+低优先级任务最多只能占用一部分并发名额，保证后台批量任务不会饿死交互任务
+"""
+import concurrent.futures
+import heapq
+import itertools
+import os
+import subprocess
+import threading
+import time
+
+# 优先级类别 -> (出队顺序, nice 值)
+PRIORITY_CLASSES = {
+    'interactive': (0, 0),
+    'normal': (1, 5),
+    'background': (2, 15),
+}
+
+
+def run_queue_pressure():
+    """返回 (1 分钟平均负载, 当前可运行进程数)，都按 CPU 核数归一化"""
+    cpus = os.cpu_count() or 1
+    with open('/proc/loadavg') as f:
+        fields = f.read().split()
+    running = int(fields[3].split('/')[0]) - 1  # 去掉读取 /proc/loadavg 的本进程
+    return float(fields[0]) / cpus, running / cpus
+
+
+def run_with_nice(cmd, nice_level=10):
+    """使用指定的 nice 值运行命令，结果中的 cmd 是调用方传入的原始命令"""
+    argv = ['nice', f'-n{nice_level}'] + cmd if nice_level else cmd
+    try:
+        result = subprocess.run(argv, capture_output=True, text=True, check=True)
+        return {'cmd': cmd, 'success': True, 'output': result.stdout}
+    except Exception as e:
+        return {'cmd': cmd, 'success': False, 'error': str(e)}
+
+
+class AdaptiveScheduler:
+    def __init__(self, min_workers=1, max_workers=None, background_share=0.5, interval=0.2):
+        cpus = os.cpu_count() or 1
+        self.min_workers = min_workers
+        self.max_workers = max_workers or cpus * 4
+        self.background_share = background_share  # 后台任务最多占用的并发比例
+        self.interval = interval
+        self.limit = cpus  # 当前并发上限
+        self.running = {name: 0 for name in PRIORITY_CLASSES}
+        self.queue = []  # (出队顺序, 序号, 类别, cmd, future, 提交时间)
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.limit_history = []
+        self.peak_running = 0  # 同时运行的任务数的最大值
+
+        self.workers = [threading.Thread(target=self._worker, daemon=True)
+                        for _ in range(self.max_workers)]
+        for worker in self.workers:
+            worker.start()
+        self.controller = threading.Thread(target=self._control, daemon=True)
+        self.controller.start()
+
+    def submit(self, cmd, priority='normal'):
+        """提交命令，返回 Future"""
+        rank, _ = PRIORITY_CLASSES[priority]
+        future = concurrent.futures.Future()
+        with self.cond:
+            heapq.heappush(self.queue, (rank, next(self.counter), priority, cmd, future, time.monotonic()))
+            self.cond.notify()
+        return future
+
+    def _can_start(self, priority):
+        total = sum(self.running.values())
+        if total >= self.limit:
+            return False
+        if priority == 'background':
+            return self.running['background'] < max(1, int(self.limit * self.background_share))
+        return True
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                # 关闭后仍然按并发上限逐个取出剩余的任务，队列为空时才退出
+                while not (self.queue and self._can_start(self.queue[0][2])):
+                    if self.closed and not self.queue:
+                        return
+                    self.cond.wait()
+                _, _, priority, cmd, future, submitted = heapq.heappop(self.queue)
+                self.running[priority] += 1
+                self.peak_running = max(self.peak_running, sum(self.running.values()))
+
+            started = time.monotonic()
+            result = run_with_nice(cmd, PRIORITY_CLASSES[priority][1])
+            finished = time.monotonic()
+            result.update({'priority': priority,
+                           'queued_time': started - submitted,
+                           'latency': finished - submitted})
+
+            with self.cond:
+                self.running[priority] -= 1
+                self.cond.notify_all()
+            future.set_result(result)
+
+    def _control(self):
+        """定期根据负载调整并发上限 (AIMD)"""
+        while True:
+            time.sleep(self.interval)
+            load, runnable = run_queue_pressure()
+            with self.cond:
+                if self.closed:
+                    return
+                if runnable > 1.5 or load > 2.0:
+                    self.limit = max(self.min_workers, self.limit // 2)
+                elif runnable < 1.0 and self.queue:
+                    self.limit = min(self.max_workers, self.limit + 1)
+                self.limit_history.append(self.limit)
+                self.cond.notify_all()
+
+    def shutdown(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(name, results, elapsed):
+    interactive = [r['latency'] for r in results if r['priority'] == 'interactive']
+    print(f"{name}: 吞吐量 {len(results) / elapsed:.1f} 个/秒, "
+          f"交互任务延迟 p50 {percentile(interactive, 0.5) * 1000:.0f} ms, "
+          f"p99 {percentile(interactive, 0.99) * 1000:.0f} ms")
+
+
+# 混合负载: 大量后台 CPU 任务 + 周期性到达的交互任务
+background_cmd = ['bash', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done']
+interactive_cmd = ['echo', 'hello']
+n_background = 60
+n_interactive = 40
+
+print(f"CPU 核数: {os.cpu_count()}, 当前负载: {os.getloadavg()}")
+
+# 基准: 05-batch-execute.py 的固定线程池，没有优先级
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+
+
+def timed(cmd, priority, submitted):
+    result = run_with_nice(cmd, 0)
+    result.update({'priority': priority, 'latency': time.monotonic() - submitted})
+    return result
+
+
+start = time.monotonic()
+futures = [executor.submit(timed, background_cmd, 'background', time.monotonic()) for _ in range(n_background)]
+for _ in range(n_interactive):
+    time.sleep(0.05)
+    futures.append(executor.submit(timed, interactive_cmd, 'interactive', time.monotonic()))
+results = [f.result() for f in futures]
+report("固定 max_workers=5", results, time.monotonic() - start)
+executor.shutdown()
+
+# 自适应调度器
+scheduler = AdaptiveScheduler()
+start = time.monotonic()
+futures = [scheduler.submit(background_cmd, 'background') for _ in range(n_background)]
+for _ in range(n_interactive):
+    time.sleep(0.05)
+    futures.append(scheduler.submit(interactive_cmd, 'interactive'))
+results = [f.result() for f in futures]
+report("自适应调度器", results, time.monotonic() - start)
+print(f"并发上限范围: {min(scheduler.limit_history)} ~ {max(scheduler.limit_history)}")
+scheduler.shutdown()
+
+# 提交后立即关闭: 剩余的任务仍然受并发上限约束
+scheduler = AdaptiveScheduler(max_workers=8)
+futures = [scheduler.submit(['sleep', '0.1']) for _ in range(16)]
+limit = scheduler.limit
+scheduler.shutdown()
+print(f"\n关闭时排队 16 个任务: 并发上限 {limit}, 实际最大并发 {scheduler.peak_running}, "
+      f"cmd {futures[0].result()['cmd']}")
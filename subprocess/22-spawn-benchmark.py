@@ -0,0 +1,350 @@
+"""
+子进程启动方式的基准测试
+覆盖本目录中用到的启动方式: subprocess.run、Popen.communicate、线程池批量执行、
+select 监控多进程、nice 包装，以及 asyncio 批量执行 (12)、selectors 监控 (13)、
+prlimit 资源限制 (15) 和预热解释器池 (16)
+预热解释器池执行的是等价的 Python 代码而不是外部命令，池的启动时间不计入结果
+在不同输出大小和并发数下记录吞吐量、p50/p99 延迟、每个子进程的内存和文件描述符开销
+结果以 JSON 输出，可以与上一次的结果对比发现性能回退
+
+用法: python 22-spawn-benchmark.py [结果.json] [基线.json]
+"""
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import select
+import selectors
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+OUTPUT_SIZES = [0, 64 * 1024, 1024 * 1024]
+CONCURRENCY_LEVELS = [1, 8]
+SPAWNS = 100
+REGRESSION_TOLERANCE = 0.2  # 吞吐量下降或 p99 上升超过 20% 视为回退
+
+
+def make_command(output_size):
+    """生成输出指定字节数的命令"""
+    if output_size == 0:
+        return ['true']
+    return ['head', '-c', str(output_size), '/dev/zero']
+
+
+def strategy_run(commands, concurrency):
+    """subprocess.run 逐个执行 (忽略并发数)"""
+    latencies = []
+    for cmd in commands:
+        start = time.perf_counter()
+        subprocess.run(cmd, capture_output=True, text=True)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def strategy_communicate(commands, concurrency):
+    """每次启动 concurrency 个 Popen，再依次 communicate"""
+    latencies = []
+    for i in range(0, len(commands), concurrency):
+        started = []
+        for cmd in commands[i:i + concurrency]:
+            start = time.perf_counter()
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            started.append((start, process))
+        for start, process in started:
+            process.communicate()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _run_timed(cmd):
+    start = time.perf_counter()
+    subprocess.run(cmd, capture_output=True, text=True)
+    return time.perf_counter() - start
+
+
+def strategy_thread_pool(commands, concurrency):
+    """05-batch-execute.py 的线程池批量执行"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(_run_timed, commands))
+
+
+def strategy_nice(commands, concurrency):
+    """09-control-process-nices.py 的 nice 包装，使用线程池并发"""
+    nice_commands = [['nice', '-n10'] + cmd for cmd in commands]
+    return strategy_thread_pool(nice_commands, concurrency)
+
+
+def strategy_select(commands, concurrency):
+    """07-monitoring-multiprocess.py 的 select 监控，同时保持 concurrency 个子进程"""
+    pending = list(commands)
+    running = {}  # fd -> (process, 启动时间)
+    latencies = []
+    while pending or running:
+        while pending and len(running) < concurrency:
+            start = time.perf_counter()
+            process = subprocess.Popen(pending.pop(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            running[process.stdout.fileno()] = (process, start)
+        readable, _, _ = select.select(list(running), [], [], 0.1)
+        for fd in readable:
+            if not os.read(fd, 65536):
+                process, start = running.pop(fd)
+                process.stdout.close()
+                process.wait()
+                latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def strategy_asyncio(commands, concurrency):
+    """12-async-batch-execute.py 的 asyncio 批量执行，Semaphore 限制并发"""
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(cmd):
+            async with semaphore:
+                start = time.perf_counter()
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                await process.communicate()
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(run(cmd) for cmd in commands))
+
+    return asyncio.run(run_all())
+
+
+def strategy_selectors(commands, concurrency):
+    """13-selector-monitor.py 的 selectors 监控: 每个流只注册一次，按 64KB 读取"""
+    selector = selectors.DefaultSelector()
+    pending = list(commands)
+    latencies = []
+    while pending or selector.get_map():
+        while pending and len(selector.get_map()) < concurrency:
+            start = time.perf_counter()
+            process = subprocess.Popen(pending.pop(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            selector.register(process.stdout, selectors.EVENT_READ, (process, start))
+        for key, _ in selector.select():
+            if not os.read(key.fd, 65536):
+                process, start = key.data
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                process.wait()
+                latencies.append(time.perf_counter() - start)
+    selector.close()
+    return latencies
+
+
+# 与 08-set-resource-limits.py 中的限制相同 (内存放宽到 1GB，避免影响 head 的输出)
+LIMITS = {
+    resource.RLIMIT_CPU: (10, 10),
+    resource.RLIMIT_AS: (1024 ** 3, 1024 ** 3),
+}
+PRLIMIT = shutil.which('prlimit')
+
+
+def strategy_prlimit(commands, concurrency):
+    """15-fast-spawn-resource-limits.py 的 prlimit 包装，使用线程池并发"""
+    options = [f'--cpu={LIMITS[resource.RLIMIT_CPU][0]}', f'--as={LIMITS[resource.RLIMIT_AS][0]}']
+    return strategy_thread_pool([[PRLIMIT] + options + ['--'] + cmd for cmd in commands], concurrency)
+
+
+def _warm_worker(conn):
+    """16-warm-interpreter-pool.py 的工作进程: 每个任务 fork 一个子进程执行，输出写入临时文件"""
+    stdout_file = tempfile.TemporaryFile()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        stdout_file.seek(0)
+        stdout_file.truncate()
+        pid = os.fork()
+        if pid == 0:
+            os.dup2(stdout_file.fileno(), 1)
+            for limit, value in LIMITS.items():
+                resource.setrlimit(limit, value)
+            code = 0
+            try:
+                exec(job, {'__name__': '__main__'})
+                sys.stdout.flush()
+            except BaseException:
+                code = 1
+            os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        stdout_file.seek(0)
+        conn.send((os.waitstatus_to_exitcode(status), stdout_file.read()))
+
+
+warm_workers = queue.Queue()  # 池在第一次使用时创建，之后复用，启动时间不计入结果
+
+
+def make_job(cmd):
+    """把 make_command 生成的命令换成输出相同字节数的 Python 代码"""
+    if cmd == ['true']:
+        return 'pass'
+    return f'import sys; sys.stdout.buffer.write(bytes({cmd[2]}))'
+
+
+def strategy_warm_pool(commands, concurrency):
+    """16-warm-interpreter-pool.py 的预热解释器池"""
+    ctx = multiprocessing.get_context('forkserver')
+    while warm_workers.qsize() < concurrency:
+        parent_conn, child_conn = ctx.Pipe()
+        ctx.Process(target=_warm_worker, args=(child_conn,), daemon=True).start()
+        child_conn.close()
+        warm_workers.put(parent_conn)
+
+    def run(cmd):
+        conn = warm_workers.get()
+        try:
+            start = time.perf_counter()
+            conn.send(make_job(cmd))
+            conn.recv()
+            return time.perf_counter() - start
+        finally:
+            warm_workers.put(conn)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(run, commands))
+
+
+STRATEGIES = {
+    'subprocess.run': strategy_run,
+    'Popen.communicate': strategy_communicate,
+    'thread_pool': strategy_thread_pool,
+    'select_monitor': strategy_select,
+    'nice': strategy_nice,
+    'asyncio': strategy_asyncio,
+    'selectors_monitor': strategy_selectors,
+    'warm_pool': strategy_warm_pool,
+}
+if PRLIMIT:
+    STRATEGIES['prlimit'] = strategy_prlimit
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def count_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def measure_overhead(strategy, commands, concurrency):
+    """单独运行一小批，测量峰值 Python 堆内存和文件描述符数，按并发数平均"""
+    baseline_fds = count_fds()
+    peak_fds = [baseline_fds]
+    stop = threading.Event()
+
+    def sample_fds():
+        while not stop.wait(0.001):
+            try:
+                peak_fds[0] = max(peak_fds[0], count_fds())
+            except OSError:
+                pass
+
+    sampler = threading.Thread(target=sample_fds, daemon=True)
+    sampler.start()
+    tracemalloc.start()
+    strategy(commands, concurrency)
+    _, peak_heap = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop.set()
+    sampler.join()
+
+    in_flight = min(concurrency, len(commands))
+    return peak_heap / 1024 / in_flight, (peak_fds[0] - baseline_fds) / in_flight
+
+
+def run_benchmarks():
+    results = []
+    for name, strategy in STRATEGIES.items():
+        for output_size in OUTPUT_SIZES:
+            for concurrency in CONCURRENCY_LEVELS:
+                if name == 'subprocess.run' and concurrency > 1:
+                    continue  # 这种方式没有并发
+                commands = [make_command(output_size)] * SPAWNS
+                # 先运行一小批预热，预热解释器池的工作进程也在这里创建
+                strategy(commands[:concurrency], concurrency)
+
+                start = time.perf_counter()
+                latencies = strategy(commands, concurrency)
+                elapsed = time.perf_counter() - start
+
+                heap_kb, fds = measure_overhead(strategy, commands[:concurrency * 2], concurrency)
+                result = {
+                    'strategy': name,
+                    'output_size': output_size,
+                    'concurrency': concurrency,
+                    'spawns': len(latencies),
+                    'throughput': len(latencies) / elapsed,
+                    'p50_ms': percentile(latencies, 0.5) * 1000,
+                    'p99_ms': percentile(latencies, 0.99) * 1000,
+                    'heap_kb_per_spawn': heap_kb,
+                    'fds_per_spawn': fds,
+                }
+                results.append(result)
+                print(f"{name:18} 输出 {output_size:>8} 字节 并发 {concurrency}: "
+                      f"{result['throughput']:7.1f} 个/秒, p50 {result['p50_ms']:6.2f} ms, "
+                      f"p99 {result['p99_ms']:6.2f} ms, 堆 {heap_kb:8.1f} KB/个, fd {fds:.1f} 个/个",
+                      file=sys.stderr)
+    return results
+
+
+def find_regressions(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """对比两次结果，返回吞吐量下降或 p99 上升超过 tolerance 的配置"""
+    def key(r):
+        return r['strategy'], r['output_size'], r['concurrency']
+
+    old = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        before = old.get(key(r))
+        if before is None:
+            continue
+        if r['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append({'config': key(r), 'metric': 'throughput',
+                                'before': before['throughput'], 'after': r['throughput']})
+        if r['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append({'config': key(r), 'metric': 'p99_ms',
+                                'before': before['p99_ms'], 'after': r['p99_ms']})
+    return regressions
+
+
+if __name__ == '__main__':
+    # forkserver 会重新导入主模块，测试代码需要放在 __main__ 保护下
+    report = {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'spawns_per_config': SPAWNS,
+            'timestamp': time.time(),
+        },
+        'results': run_benchmarks(),
+    }
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"结果已写入 {sys.argv[1]}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            regressions = find_regressions(json.load(f), report)
+        for r in regressions:
+            print(f"性能回退: {r['config']} {r['metric']} {r['before']:.2f} -> {r['after']:.2f}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
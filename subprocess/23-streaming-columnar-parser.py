@@ -0,0 +1,183 @@
+"""
+ps/ls 输出的流式列存解析
+11-Cross-platform-compatible.py 把整个 stdout 读成一个字符串再 splitlines()，
+进程或文件很多时会产生很大的临时字符串和行列表
+这里按块读取管道、增量切分行，解析结果按列存放在 array 和列表中 (__slots__ 类)
+可以只读取前 N 行，之后立即结束子进程
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+
+CHUNK_SIZE = 65536
+
+
+class ProcessTable:
+    """ps -ef 的列存结果，格式不对的行跳过并计入 skipped"""
+    __slots__ = ('pid', 'ppid', 'user', 'cmd', 'skipped')
+
+    def __init__(self):
+        self.pid = array('i')
+        self.ppid = array('i')
+        self.user = []
+        self.cmd = []
+        self.skipped = 0
+
+    def append(self, line):
+        # UID PID PPID C STIME TTY TIME CMD
+        fields = line.split(None, 7)
+        try:
+            # 先解析完整行再写入各列，出错时各列长度保持一致
+            pid, ppid, cmd = int(fields[1]), int(fields[2]), fields[7]
+        except (IndexError, ValueError):
+            self.skipped += 1
+            return
+        self.user.append(sys.intern(fields[0]))  # 用户名重复很多，驻留以节省内存
+        self.pid.append(pid)
+        self.ppid.append(ppid)
+        self.cmd.append(cmd)
+
+    def __len__(self):
+        return len(self.pid)
+
+    def row(self, i):
+        return self.pid[i], self.ppid[i], self.user[i], self.cmd[i]
+
+
+class DirectoryTable:
+    """ls -la 的列存结果，格式不对的行跳过并计入 skipped"""
+    __slots__ = ('mode', 'size', 'name', 'skipped')
+
+    def __init__(self):
+        self.mode = []
+        self.size = array('q')
+        self.name = []
+        self.skipped = 0
+
+    def append(self, line):
+        # mode links owner group size month day time/year name
+        if line.startswith('total '):
+            return
+        try:
+            if line.startswith(('c', 'b')):
+                # 设备文件没有大小，这一列是 "主设备号, 次设备号"，多占一列
+                fields = line.split(None, 9)
+                size, name = 0, fields[9]
+            else:
+                fields = line.split(None, 8)
+                size, name = int(fields[4]), fields[8]
+        except (IndexError, ValueError):
+            self.skipped += 1
+            return
+        self.mode.append(sys.intern(fields[0]))
+        self.size.append(size)
+        self.name.append(name)
+
+    def __len__(self):
+        return len(self.size)
+
+    def row(self, i):
+        return self.mode[i], self.size[i], self.name[i]
+
+
+def iter_lines(process):
+    """按块读取子进程 stdout，逐行产出"""
+    fd = process.stdout.fileno()
+    pending = b''
+    while True:
+        chunk = os.read(fd, CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode(errors='replace')
+    if pending:
+        yield pending.decode(errors='replace')
+
+
+def parse_command(cmd, table, limit=None, skip_header=True):
+    """运行命令并把输出流式解析到 table，读到 limit 行后结束子进程"""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    lines = iter_lines(process)
+    if skip_header:
+        next(lines, None)
+    for line in lines:
+        table.append(line)
+        if limit is not None and len(table) >= limit:
+            # 提前结束: 不再读取剩余输出
+            process.kill()
+            break
+    lines.close()
+    process.stdout.close()
+    process.wait()
+    return table
+
+
+def list_processes(limit=None):
+    return parse_command(['ps', '-ef'], ProcessTable(), limit)
+
+
+def list_dir(path='.', limit=None):
+    return parse_command(['ls', '-la', path], DirectoryTable(), limit, skip_header=False)
+
+
+# 测试
+processes = list_processes()
+print(f"进程数: {len(processes)}")
+for i in range(min(5, len(processes))):
+    print(f"  {processes.row(i)}")
+
+entries = list_dir('.')
+print(f"\n当前目录条目数: {len(entries)}, 总大小: {sum(entries.size)} 字节")
+for i in range(min(5, len(entries))):
+    print(f"  {entries.row(i)}")
+
+# 格式不对或被截断的行: 跳过并计数，不中断解析
+table = ProcessTable()
+for line in ('root 1 0 0 10:00 ? 00:00:01 /sbin/init',
+             'root x 0 0 10:00 ? 00:00:00 bad pid',
+             'root 2 0 0 10:00 ?'):
+    table.append(line)
+print(f"\n解析 3 行 ps 输出: {len(table)} 行有效, 跳过 {table.skipped} 行")
+
+# 设备文件: 大小一列是设备号，按 0 记录
+devices = list_dir('/dev')
+print(f"\n/dev 条目数: {len(devices)}")
+for i in range(len(devices)):
+    if devices.mode[i].startswith('c'):
+        print(f"  {devices.row(i)}")
+        break
+
+# 大目录: 对比一次性读取和流式列存解析
+with tempfile.TemporaryDirectory() as tmpdir:
+    n = 50000
+    for i in range(n):
+        open(os.path.join(tmpdir, f'file-{i:06d}.txt'), 'w').close()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = subprocess.run(['ls', '-la', tmpdir], capture_output=True, text=True)
+    rows = [line.split(None, 8) for line in result.stdout.splitlines()[1:]]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"\ncapture_output + splitlines: {len(rows)} 行, 耗时 {elapsed:.2f} 秒, 内存峰值 {peak / 1024 / 1024:.1f} MB")
+    del result, rows
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    table = list_dir(tmpdir)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"流式列存解析: {len(table)} 行, 耗时 {elapsed:.2f} 秒, 内存峰值 {peak / 1024 / 1024:.1f} MB")
+
+    start = time.perf_counter()
+    table = list_dir(tmpdir, limit=10)
+    elapsed = time.perf_counter() - start
+    print(f"只读取前 10 行: {len(table)} 行, 耗时 {elapsed * 1000:.1f} 毫秒")
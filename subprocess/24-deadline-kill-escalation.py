@@ -0,0 +1,178 @@
+"""
+每个子进程独立的截止时间，以及 SIGTERM -> SIGKILL 的逐级终止
+所有定时事件放在一个最小堆中，selector.select 的超时就是堆顶的到期时间，不需要轮询
+到期后先发 SIGTERM，宽限期过后仍未退出再发 SIGKILL，所有子进程同时进行，
+关闭 1000 个子进程只需要一个宽限期，而不是 2 秒 x N
+子进程在独立的进程组中运行，信号发给整个进程组，孙进程也会一起结束
+"""
+import heapq
+import itertools
+import os
+import selectors
+import signal
+import subprocess
+import time
+
+CHUNK_SIZE = 65536
+
+
+class TimerHeap:
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+    def push(self, when, action, p):
+        heapq.heappush(self.heap, (when, next(self.counter), action, p))
+
+    def next_timeout(self, now):
+        """距离最近一个定时事件的秒数，没有事件时返回 None"""
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - now)
+
+    def pop_expired(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            when, _, action, p = heapq.heappop(self.heap)
+            yield action, p
+
+
+def send_signal(p, sig):
+    try:
+        os.killpg(p['process'].pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def monitor_multiple_processes(commands, timeout=60, grace=2, verbose=True):
+    """同时监控多个进程的输出，commands 中的元素可以是 cmd 或 (cmd, 该命令的超时秒数)"""
+    selector = selectors.DefaultSelector()
+    timers = TimerHeap()
+    processes = []
+
+    for i, item in enumerate(commands):
+        cmd, cmd_timeout = item if isinstance(item[0], list) else (item, timeout)
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   start_new_session=True)
+        p = {
+            'process': process,
+            'cmd': cmd,
+            'index': i,
+            'stdout_lines': [],
+            'stderr_lines': [],
+            'open_streams': 2,
+            'state': 'running'
+        }
+        processes.append(p)
+        timers.push(time.monotonic() + cmd_timeout, 'term', p)
+        for stream_name, stream in (('stdout', process.stdout), ('stderr', process.stderr)):
+            selector.register(stream, selectors.EVENT_READ, [p, stream_name, b''])
+
+    def describe(p):
+        return f"进程 {p['index']} ({' '.join(p['cmd'])})"
+
+    exiting = []  # 不支持 pidfd 时: 输出已经读完、还没有退出的进程，每轮用 poll 检查
+
+    def wait_exit(p):
+        """输出读完后等待进程退出 (进程可能关闭了输出但仍在运行)
+        把 pidfd 注册到同一个 selector，退出时变为可读，不阻塞在 wait 上，定时事件照常处理"""
+        try:
+            pidfd = os.pidfd_open(p['process'].pid)
+        except (AttributeError, OSError):
+            exiting.append(p)
+            return
+        selector.register(pidfd, selectors.EVENT_READ, [p, None, None])
+
+    def on_exit(p):
+        p['exit_code'] = p['process'].returncode
+        if verbose:
+            print(f"{describe(p)} 已结束，返回码: {p['exit_code']}")
+        p['state'] = 'exited'
+
+    while selector.get_map() or exiting:
+        select_timeout = timers.next_timeout(time.monotonic())
+        if exiting:
+            select_timeout = 0.05 if select_timeout is None else min(select_timeout, 0.05)
+        for key, _ in selector.select(select_timeout):
+            p, stream_name, pending = key.data
+            if stream_name is None:
+                # pidfd 可读: 进程已经退出，wait 不会阻塞
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                p['process'].wait()
+                on_exit(p)
+                continue
+            chunk = os.read(key.fd, CHUNK_SIZE)
+            if not chunk:
+                if pending:
+                    p[f'{stream_name}_lines'].append(pending.decode(errors='replace').strip())
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                p['open_streams'] -= 1
+                if p['open_streams'] == 0:
+                    wait_exit(p)
+                continue
+            lines = (pending + chunk).split(b'\n')
+            key.data[2] = lines.pop()
+            for line in lines:
+                p[f'{stream_name}_lines'].append(line.decode(errors='replace').strip())
+
+        for p in list(exiting):
+            if p['process'].poll() is not None:
+                exiting.remove(p)
+                on_exit(p)
+
+        # 处理到期的定时事件，已经结束的进程直接跳过
+        now = time.monotonic()
+        for action, p in timers.pop_expired(now):
+            if p['state'] == 'exited':
+                continue
+            if action == 'term':
+                if verbose:
+                    print(f"{describe(p)} 超时，发送 SIGTERM")
+                send_signal(p, signal.SIGTERM)
+                p['state'] = 'terminating'
+                timers.push(now + grace, 'kill', p)
+            elif action == 'kill':
+                if verbose:
+                    print(f"{describe(p)} 宽限期内未退出，发送 SIGKILL")
+                send_signal(p, signal.SIGKILL)
+                p['state'] = 'killed'
+
+    selector.close()
+    return processes
+
+
+# 测试: 每个命令有自己的截止时间
+commands = [
+    (['bash', '-c', 'for i in {1..3}; do echo "Process 1: $i"; sleep 0.5; done'], 5),
+    (['bash', '-c', 'for i in {1..10}; do echo "Process 2: $i"; sleep 0.5; done'], 1),
+    (['bash', '-c', 'trap "" TERM; echo "Process 3 ignores SIGTERM"; sleep 30'], 1),
+    # 关闭输出后继续运行的进程: 输出读完后仍按截止时间终止
+    (['bash', '-c', 'exec >&- 2>&-; sleep 30'], 1),
+]
+
+print("开始监控多个进程:")
+start = time.monotonic()
+results = monitor_multiple_processes(commands, grace=1)
+print(f"耗时 {time.monotonic() - start:.2f} 秒")
+for p in results:
+    print(f"{' '.join(p['cmd'])[:50]}: 返回码 {p['exit_code']}, stdout 行数 {len(p['stdout_lines'])}")
+
+# 1000 个子进程同时超时，其中一部分忽略 SIGTERM
+# 注意: 需要 ulimit -n 大于 2000
+n = 1000
+many_commands = []
+for i in range(n):
+    if i % 5 == 0:
+        many_commands.append(['bash', '-c', 'trap "" TERM; sleep 100'])
+    else:
+        many_commands.append(['sleep', '100'])
+
+start = time.monotonic()
+results = monitor_multiple_processes(many_commands, timeout=1, grace=1, verbose=False)
+elapsed = time.monotonic() - start
+terminated = sum(1 for p in results if p['exit_code'] == -signal.SIGTERM)
+killed = sum(1 for p in results if p['exit_code'] == -signal.SIGKILL)
+print(f"\n关闭 {n} 个子进程耗时 {elapsed:.2f} 秒 (含启动): SIGTERM 结束 {terminated} 个, SIGKILL 结束 {killed} 个")
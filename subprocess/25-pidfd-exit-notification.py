@@ -0,0 +1,252 @@
+"""
+基于 pidfd 的子进程退出通知
+在 Linux 5.3+ 上用 os.pidfd_open 为每个子进程打开一个 pidfd，与输出管道注册在同一个 selector 中，
+子进程退出时 pidfd 变为可读，每次退出只处理一次，不需要每轮对所有进程调用 poll()
+不支持 pidfd 时退回到 SIGCHLD: 通过 signal.set_wakeup_fd 把信号转成 selector 上的可读事件，
+收到信号后循环调用 waitpid(-1, WNOHANG)，开销与退出的进程数成正比，与注册的进程数无关
+注意: SIGCHLD 模式会回收本进程的所有子进程 (不属于这里的子进程的退出码会丢失)，
+只适合子进程都由 ExitNotifier 管理的程序；set_wakeup_fd 只能在主线程中调用
+"""
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+
+CHUNK_SIZE = 65536
+
+
+class ExitNotifier:
+    def __init__(self, selector, use_pidfd=None):
+        self.selector = selector
+        if use_pidfd is None:
+            use_pidfd = hasattr(os, 'pidfd_open')
+        self.use_pidfd = use_pidfd
+        self.by_pid = {}  # pid -> (process, data)，只在 SIGCHLD 模式下使用
+        self.unclaimed = {}  # 已回收但尚未注册的 pid -> 返回码，只在 SIGCHLD 模式下使用
+
+        if not self.use_pidfd:
+            if threading.current_thread() is not threading.main_thread():
+                raise RuntimeError("SIGCHLD 模式需要 signal.set_wakeup_fd，只能在主线程中使用")
+            # SIGCHLD 模式: 信号处理函数什么都不做，靠 wakeup fd 唤醒 selector
+            self.wakeup_r, self.wakeup_w = os.pipe()
+            os.set_blocking(self.wakeup_r, False)
+            os.set_blocking(self.wakeup_w, False)
+            self.old_wakeup_fd = signal.set_wakeup_fd(self.wakeup_w)
+            self.old_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+            selector.register(self.wakeup_r, selectors.EVENT_READ, ('sigchld', None))
+
+    def register(self, process, data):
+        """注册子进程，退出时 handle 返回 (process, data)"""
+        if self.use_pidfd:
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError:
+                # 进程已经退出并被回收，或者内核不支持
+                process.wait()
+                return [(process, data)]
+            self.selector.register(pidfd, selectors.EVENT_READ, ('exit', (process, data)))
+            return []
+        # 注册前可能已经退出: 已经被 _reap_sigchld 回收，或者 SIGCHLD 已经错过
+        if process.pid in self.unclaimed:
+            process.returncode = self.unclaimed.pop(process.pid)
+            return [(process, data)]
+        if process.poll() is not None:
+            return [(process, data)]
+        self.by_pid[process.pid] = (process, data)
+        return []
+
+    def handle(self, key):
+        """处理 selector 返回的退出事件，返回已退出的 (process, data) 列表"""
+        kind, payload = key.data
+        if kind == 'exit':
+            self.selector.unregister(key.fd)
+            os.close(key.fd)
+            process, data = payload
+            process.wait()  # 已经退出，不会阻塞
+            return [(process, data)]
+        try:
+            while os.read(self.wakeup_r, CHUNK_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        return self._reap_sigchld()
+
+    def _reap_sigchld(self):
+        """回收所有已经退出的子进程，每次只处理真正退出的进程，不遍历 by_pid"""
+        exited = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            returncode = os.waitstatus_to_exitcode(status)
+            if pid not in self.by_pid:
+                self.unclaimed[pid] = returncode  # 还没有注册，或者不属于这里
+                continue
+            process, data = self.by_pid.pop(pid)
+            process.returncode = returncode  # 已经回收，之后的 poll/wait 直接返回这个值
+            exited.append((process, data))
+        return exited
+
+    def close(self):
+        if not self.use_pidfd:
+            self.selector.unregister(self.wakeup_r)
+            signal.set_wakeup_fd(self.old_wakeup_fd)
+            signal.signal(signal.SIGCHLD, self.old_handler)
+            os.close(self.wakeup_r)
+            os.close(self.wakeup_w)
+
+
+def read_stream(selector, key, on_line):
+    """读取一块数据并按行回调，EOF 时注销流并返回 False
+    先注销再关闭: 关闭后的 fd 无法直接查找，selector 会退回到遍历整个注册表"""
+    stream_name, pending = key.data[1], key.data[2]
+    chunk = os.read(key.fd, CHUNK_SIZE)
+    if not chunk:
+        if pending:
+            on_line(stream_name, pending.decode(errors='replace').strip())
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+        return False
+    lines = (pending + chunk).split(b'\n')
+    key.data[2] = lines.pop()
+    for line in lines:
+        on_line(stream_name, line.decode(errors='replace').strip())
+    return True
+
+
+def run_with_live_output(cmd, use_pidfd=None):
+    """运行命令并实时显示输出，输出和退出事件都由同一个 selector 处理"""
+    selector = selectors.DefaultSelector()
+    notifier = ExitNotifier(selector, use_pidfd)
+    process = subprocess.Popen(cmd,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    for stream_name, stream in (('stdout', process.stdout), ('stderr', process.stderr)):
+        selector.register(stream, selectors.EVENT_READ, ['stream', stream_name, b''])
+    exited = bool(notifier.register(process, None))
+
+    def on_line(stream_name, line):
+        print(f"{stream_name}: {line}")
+
+    # 退出且两个流都读完后结束
+    while not exited or len(selector.get_map()) > (0 if notifier.use_pidfd else 1):
+        for key, _ in selector.select():
+            if key.data[0] == 'stream':
+                read_stream(selector, key, on_line)
+            elif notifier.handle(key):
+                exited = True
+
+    notifier.close()
+    selector.close()
+    return process.returncode
+
+
+def monitor_multiple_processes(commands, timeout=60, use_pidfd=None, verbose=True):
+    """同时监控多个进程的输出，进程退出由 pidfd/SIGCHLD 事件驱动"""
+    selector = selectors.DefaultSelector()
+    notifier = ExitNotifier(selector, use_pidfd)
+    processes = []
+    remaining = 0
+
+    def on_exit(p):
+        nonlocal remaining
+        p['exit_code'] = p['process'].returncode
+        remaining -= 1
+        if verbose:
+            print(f"进程 {p['index']} ({' '.join(p['cmd'])}) 已结束，返回码: {p['exit_code']}")
+
+    for i, cmd in enumerate(commands):
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        p = {
+            'process': process,
+            'cmd': cmd,
+            'index': i,
+            'stdout_lines': [],
+            'stderr_lines': []
+        }
+        processes.append(p)
+        remaining += 1
+        for stream_name, stream in (('stdout', process.stdout), ('stderr', process.stderr)):
+            selector.register(stream, selectors.EVENT_READ, ['stream', stream_name, b'', p])
+        for _, exited_p in notifier.register(process, p):
+            on_exit(exited_p)
+
+    def collect(p):
+        def on_line(stream_name, line):
+            p[f'{stream_name}_lines'].append(line)
+            if verbose:
+                print(f"进程 {p['index']} ({' '.join(p['cmd'])}) {stream_name}: {line}")
+        return on_line
+
+    deadline = time.monotonic() + timeout
+    open_streams = 2 * len(processes)
+    while (remaining > 0 or open_streams > 0) and time.monotonic() < deadline:
+        for key, _ in selector.select(deadline - time.monotonic()):
+            if key.data[0] == 'stream':
+                if not read_stream(selector, key, collect(key.data[3])):
+                    open_streams -= 1
+            else:
+                for _, p in notifier.handle(key):
+                    on_exit(p)
+
+    # 超时: 终止仍在运行的进程
+    for p in processes:
+        if 'exit_code' not in p:
+            p['process'].kill()
+            p['exit_code'] = p['process'].wait()
+            if verbose:
+                print(f"进程 {p['index']} ({' '.join(p['cmd'])}) 被终止，返回码: {p['exit_code']}")
+    for key in list(selector.get_map().values()):
+        if key.data[0] == 'stream':
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+        elif key.data[0] == 'exit':
+            selector.unregister(key.fd)
+            os.close(key.fd)
+    notifier.close()
+    selector.close()
+    return processes
+
+
+# 测试实时输出
+print(f"支持 pidfd: {hasattr(os, 'pidfd_open')}")
+print("运行命令并实时显示输出:")
+return_code = run_with_live_output(['bash', '-c',
+                                    'for i in {1..3}; do echo "Line $i"; sleep 0.5; done; echo "Error line" >&2; exit 3'])
+print(f"命令结束，返回码: {return_code}")
+
+# 测试同时监控多个进程
+commands = [
+    ['bash', '-c', 'for i in {1..3}; do echo "Process 1: $i"; sleep 1; done'],
+    ['bash', '-c', 'for i in {1..5}; do echo "Process 2: $i"; sleep 0.5; done'],
+    ['bash', '-c', 'for i in {1..2}; do echo "Process 3: $i"; echo "Error in 3" >&2; sleep 1; done; exit 1']
+]
+
+# 不属于 ExitNotifier 的僵尸进程不会卡住 SIGCHLD 模式 (它会被回收，退出码丢失)
+stray = subprocess.Popen(['true'])
+time.sleep(0.1)
+
+for use_pidfd in (True, False):
+    print(f"\n开始监控多个进程 ({'pidfd' if use_pidfd else 'SIGCHLD'}):")
+    results = monitor_multiple_processes(commands, use_pidfd=use_pidfd)
+    for p in results:
+        print(f"进程 {p['index']}: 返回码 {p['exit_code']}, "
+              f"stdout 行数 {len(p['stdout_lines'])}, stderr 行数 {len(p['stderr_lines'])}")
+
+# 大量子进程: 每次退出只产生一个事件
+n = 500
+many_commands = [['bash', '-c', f'sleep 0.{i % 10}; exit {i % 4}'] for i in range(n)]
+for use_pidfd in (True, False):
+    start = time.perf_counter()
+    results = monitor_multiple_processes(many_commands, use_pidfd=use_pidfd, verbose=False)
+    elapsed = time.perf_counter() - start
+    codes = sum(p['exit_code'] for p in results)
+    print(f"\n{'pidfd' if use_pidfd else 'SIGCHLD'}: {n} 个子进程耗时 {elapsed:.2f} 秒, 返回码之和 {codes} (期望 {sum(i % 4 for i in range(n))})")
+stray.wait()
@@ -0,0 +1,165 @@
+"""
+以字节为主的高吞吐输出捕获
+stderr 在后台线程中读入单独的缓冲区，不会与 stdout 混在一起，也不会因为管道写满而阻塞
+这里用 readinto 把数据读进可复用的 bytearray，通过 memoryview 访问，
+只有调用方需要文本时才解码 (一次性或增量)
+按行访问时每次取一块数据用 bytes.split 切分，速度与 text=True 逐行读取相当 (每行仍要生成一个对象)；
+明显更快的是不需要逐行对象的处理方式: 直接在缓冲区上 count/find，或者流式复用同一个缓冲区
+"""
+import codecs
+import subprocess
+import threading
+import time
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ByteCapture:
+    """把子进程的一个输出流完整读入一个不断扩容的 bytearray"""
+
+    def __init__(self, initial_size=CHUNK_SIZE):
+        self.buffer = bytearray(initial_size)
+        self.size = 0
+
+    def read_from(self, stream):
+        raw = open(stream.fileno(), 'rb', buffering=0, closefd=False)
+        while True:
+            if self.size == len(self.buffer):
+                self.buffer.extend(bytes(len(self.buffer)))  # 容量翻倍
+            with memoryview(self.buffer) as view:
+                n = raw.readinto(view[self.size:])
+            if not n:
+                break
+            self.size += n
+        return self
+
+    def view(self):
+        """全部数据的只读视图，不复制"""
+        return memoryview(self.buffer).toreadonly()[:self.size]
+
+    def iter_lines(self, chunk_size=CHUNK_SIZE):
+        """按行产出 bytes (不含换行符)，每块只调用一次 split，跨块的半行留到下一块"""
+        view = memoryview(self.buffer)
+        pending = b''
+        for start in range(0, self.size, chunk_size):
+            lines = (pending + view[start:min(start + chunk_size, self.size)]).split(b'\n')
+            pending = lines.pop()
+            yield from lines
+        if pending:
+            yield pending
+
+    def text(self, encoding='utf-8'):
+        """需要文本时再一次性解码"""
+        with memoryview(self.buffer) as view:
+            return str(view[:self.size], encoding, errors='replace')
+
+    def iter_text(self, encoding='utf-8', chunk_size=CHUNK_SIZE):
+        """增量解码，不会在块边界切断多字节字符"""
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        view = memoryview(self.buffer)
+        for start in range(0, self.size, chunk_size):
+            yield decoder.decode(view[start:min(start + chunk_size, self.size)])
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+
+def _start_stderr_reader(process):
+    """在后台线程中把 stderr 读入单独的 ByteCapture，避免两个管道互相阻塞"""
+    stderr = ByteCapture(initial_size=4096)
+    thread = threading.Thread(target=stderr.read_from, args=(process.stderr,), daemon=True)
+    thread.start()
+    return stderr, thread
+
+
+def _finish_stderr_reader(process, thread):
+    thread.join()
+    process.stderr.close()
+
+
+def capture_bytes(cmd):
+    """运行命令，以字节形式捕获 stdout 和 stderr，返回 (返回码, stdout ByteCapture, stderr ByteCapture)"""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    stderr, thread = _start_stderr_reader(process)
+    capture = ByteCapture().read_from(process.stdout)
+    process.stdout.close()
+    _finish_stderr_reader(process, thread)
+    return process.wait(), capture, stderr
+
+
+def stream_bytes(cmd, callback, chunk_size=CHUNK_SIZE):
+    """流式处理: 所有数据都读入同一个可复用缓冲区，callback 收到 (buffer, 长度)
+    callback 不能在返回后继续持有缓冲区内容
+    返回 (返回码, stderr ByteCapture)"""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    stderr, thread = _start_stderr_reader(process)
+    raw = process.stdout
+    while True:
+        n = raw.readinto(view)
+        if not n:
+            break
+        callback(buffer, n)
+    view.release()
+    raw.close()
+    _finish_stderr_reader(process, thread)
+    return process.wait(), stderr
+
+
+# 测试
+returncode, capture, stderr = capture_bytes(['bash', '-c', 'echo "第一行"; echo "second line"; printf "no newline"; '
+                                                        'echo "error line" >&2; exit 2'])
+print(f"返回码: {returncode}, 字节数: {capture.size}, 标准错误: {stderr.text().strip()}")
+for line in capture.iter_lines():
+    print(f"  行 ({len(line)} 字节): {line.decode()}")
+print(f"增量解码: {''.join(capture.iter_text(chunk_size=4))!r}")
+
+# 吞吐量对比: 约 200MB 的行输出
+size = 200 * 1024 * 1024
+cmd = ['bash', '-c', f'yes "the quick brown fox jumps over the lazy dog" | head -c {size}']
+print(f"\n输出大小: {size / 1024 / 1024:.0f} MB")
+
+
+def report(name, elapsed, lines):
+    print(f"{name:32} {elapsed:6.2f} 秒, {size / 1024 / 1024 / elapsed:7.1f} MB/秒, {lines} 行")
+
+
+# 1. 监控示例中的方式: text=True, bufsize=1 逐行读取
+start = time.perf_counter()
+process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, bufsize=1)
+lines = sum(1 for _ in process.stdout)
+process.wait()
+report("text=True, bufsize=1 逐行", time.perf_counter() - start, lines)
+
+# 2. subprocess.run(capture_output=True, text=True)
+start = time.perf_counter()
+result = subprocess.run(cmd, capture_output=True, text=True)
+lines = result.stdout.count('\n')
+del result
+report("run(capture_output, text=True)", time.perf_counter() - start, lines)
+
+# 3. 字节捕获 + 按块切分成行: 与方式 1 相当，瓶颈是逐行生成 Python 对象
+start = time.perf_counter()
+_, capture, _ = capture_bytes(cmd)
+lines = sum(1 for _ in capture.iter_lines())
+report("字节捕获 + 按块切行", time.perf_counter() - start, lines)
+
+# 4. 字节捕获，只统计换行符
+start = time.perf_counter()
+_, capture, _ = capture_bytes(cmd)
+lines = capture.buffer.count(b'\n', 0, capture.size)
+report("字节捕获 + count", time.perf_counter() - start, lines)
+del capture
+
+# 5. 流式处理，复用同一个 1MB 缓冲区
+counter = [0]
+
+
+def count_newlines(buffer, n):
+    counter[0] += buffer.count(b'\n', 0, n)
+
+
+start = time.perf_counter()
+stream_bytes(cmd, count_newlines)
+report("流式 + 复用缓冲区", time.perf_counter() - start, counter[0])
@@ -0,0 +1,145 @@
+"""
+流式的批量执行接口，带背压
+batch_execute 要等所有命令结束才返回，并且同时持有 future_to_cmd 和完整的 results 列表
+iter_batch 接受惰性的命令序列 (例如从文件逐行读取的上百万条命令)，
+同一时间最多只有 max_in_flight 个命令被提交，结果一完成就产出
+峰值内存与并发数成正比，与命令总数无关
+"""
+import collections
+import concurrent.futures
+import itertools
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+
+def run_command(cmd):
+    """执行单个命令并返回结果"""
+    try:
+        result = subprocess.run(cmd,
+                                capture_output=True,
+                                text=True,
+                                check=True)
+        return {
+            'cmd': cmd,
+            'success': True,
+            'output': result.stdout
+        }
+    except Exception as e:
+        return {
+            'cmd': cmd,
+            'success': False,
+            'error': str(e)
+        }
+
+
+def iter_batch(commands, max_workers=5, max_in_flight=None, ordered=False):
+    """并行执行命令并逐个产出结果，ordered=True 时按输入顺序产出
+    调用方提前 break 时取消尚未开始的命令，不等待正在运行的命令"""
+    max_in_flight = max_in_flight or max_workers * 2
+    commands = iter(commands)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        if ordered:
+            window = collections.deque()
+            for cmd in itertools.islice(commands, max_in_flight):
+                window.append(executor.submit(run_command, cmd))
+            while window:
+                # 队首完成后才产出，再补充一个新命令
+                result = window.popleft().result()
+                for cmd in itertools.islice(commands, 1):
+                    window.append(executor.submit(run_command, cmd))
+                yield result
+            return
+
+        in_flight = set()
+        for cmd in itertools.islice(commands, max_in_flight):
+            in_flight.add(executor.submit(run_command, cmd))
+        while in_flight:
+            done, in_flight = concurrent.futures.wait(in_flight,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+            # 完成几个就补充几个，保持提交数量不超过 max_in_flight
+            for cmd in itertools.islice(commands, len(done)):
+                in_flight.add(executor.submit(run_command, cmd))
+            for future in done:
+                yield future.result()
+    finally:
+        # with 语句退出时会等待所有已提交的命令，提前 break 时会卡住
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_commands(path):
+    """从文件逐行读取命令，不会一次性读入内存"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield shlex.split(line)
+
+
+def batch_execute(commands, max_workers=5):
+    """05-batch-execute.py 中的实现，用于对比"""
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_cmd = {executor.submit(run_command, cmd): cmd for cmd in commands}
+        for future in concurrent.futures.as_completed(future_to_cmd):
+            results.append(future.result())
+    return results
+
+
+# 测试批量执行
+commands = [
+    ['echo', 'Hello World'],
+    ['ls', '-l'],
+    ['date'],
+    ['whoami'],
+    ['non_existent_command']  # 这个会失败
+]
+
+print("按完成顺序:")
+for result in iter_batch(commands):
+    if result['success']:
+        print(f"命令 {result['cmd']} 成功: {result['output'].strip()[:40]}")
+    else:
+        print(f"命令 {result['cmd']} 失败: {result['error']}")
+
+print("\n按输入顺序:")
+print([result['cmd'][0] for result in iter_batch(commands, ordered=True)])
+
+# 提前 break: 拿到第一个结果后立即返回，不等待其余正在运行的 sleep
+start = time.perf_counter()
+for result in iter_batch([['sleep', '0']] + [['sleep', '3']] * 20, max_workers=4):
+    break
+print(f"\n提前 break 耗时 {time.perf_counter() - start:.2f} 秒")
+
+# 从文件读取大量命令，对比峰值内存
+n = 2000
+with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+    for i in range(n):
+        f.write(f"echo 'command {i} with some padding to make the output longer {'x' * 200}'\n")
+    path = f.name
+
+tracemalloc.start()
+start = time.perf_counter()
+results = batch_execute(read_commands(path))
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(f"\nbatch_execute: {len(results)} 个命令, 耗时 {elapsed:.2f} 秒, 内存峰值 {peak / 1024 / 1024:.2f} MB")
+del results
+
+tracemalloc.start()
+start = time.perf_counter()
+count = 0
+for result in iter_batch(read_commands(path)):
+    count += 1  # 结果处理完即丢弃
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(f"iter_batch: {count} 个命令, 耗时 {elapsed:.2f} 秒, 内存峰值 {peak / 1024 / 1024:.2f} MB")
+
+os.remove(path)
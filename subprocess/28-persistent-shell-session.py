@@ -0,0 +1,290 @@
+"""
+常驻 shell 会话执行器
+大部分命令只是 shell 内置命令或很小的 coreutils 调用，进程创建本身占了大部分耗时
+这里保持几个长期运行的 bash 进程，每条命令写入 bash 的 stdin，
+命令结束后输出唯一的结束标记 (含返回码)，据此切分每条命令的 stdout/stderr
+返回结构与 04-user-defined-except-process.py 中的 execute_command 一致
+会话超时、bash 退出或者命令改变了会话状态 (工作目录、umask、后台任务、shell 变量 (含 IFS)、
+shell 选项、函数、ulimit、trap) 时自动重建
+"""
+import hashlib
+import os
+import queue
+import selectors
+import shlex
+import signal
+import subprocess
+import time
+import uuid
+
+CHUNK_SIZE = 65536
+
+# 每条命令都会变化的 shell 变量，不计入会话状态；工作目录单独比较
+VOLATILE_VARS = frozenset({'_', '__rc', 'RANDOM', 'SRANDOM', 'SECONDS', 'LINENO', 'EPOCHREALTIME',
+                           'EPOCHSECONDS', 'BASHPID', 'PIPESTATUS', 'FUNCNAME', 'HISTCMD',
+                           'PWD', 'OLDPWD'})
+
+
+def _stable_settings(text):
+    """去掉 declare -p 输出中的易变变量 (值中的换行会被转义成 $'\\n'，每个变量只占一行)"""
+    lines = []
+    for line in text.splitlines():
+        if line.startswith('declare '):
+            name = line.split(' ', 2)[2].split('=', 1)[0]
+            if name in VOLATILE_VARS or name.startswith('BASH_'):
+                continue
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+class SessionBroken(Exception):
+    """会话需要重建"""
+
+
+class ShellSession:
+    def __init__(self, max_commands=1000):
+        self.max_commands = max_commands
+        self.commands = 0
+        self.process = subprocess.Popen(['bash', '--noprofile', '--norc'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        start_new_session=True)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ, 'stdout')
+        self.selector.register(self.process.stderr, selectors.EVENT_READ, 'stderr')
+        self.buffers = {'stdout': bytearray(), 'stderr': bytearray()}
+        self.initial_state = None
+        self.initial_state = self.run('true')[3]
+
+    def run(self, command, timeout=None):
+        """执行一条 shell 命令，返回 (返回码, stdout, stderr, 会话状态)"""
+        marker = f'__END_{uuid.uuid4().hex}__'
+        # 命令作为一个整体交给 eval: 语法错误 (例如引号未闭合) 只让 eval 返回 2，不会吞掉结束标记
+        # 命令的 stdin 重定向到 /dev/null，避免读走后续命令
+        # 结束标记之间是返回码和会话状态 (工作目录、umask、后台任务，以及所有 shell 变量、
+        # shell 选项、函数、ulimit 和 trap)，只用内置命令输出，不额外 fork
+        # declare -p 之前先执行 ":"，否则 $_ 的值是上一条 printf 的结束标记
+        script = (f'eval {shlex.quote(command)} </dev/null\n'
+                  f'__rc=$?; printf "{marker}%d\\n%s\\n" "$__rc" "$PWD"; umask; jobs -p; '
+                  f'printf "{marker}\\n"; :; declare -p; set -o; shopt; declare -F; ulimit -a; trap -p; '
+                  f'printf "{marker}\\n"; printf "{marker}\\n" >&2\n')
+        try:
+            self.process.stdin.write(script.encode())
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise SessionBroken('bash 已退出')
+
+        token = marker.encode()
+        out = self.buffers['stdout']
+        err = self.buffers['stderr']
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # stdout 中出现三次结束标记、stderr 中出现一次时，这条命令的输出已经读完
+        while out.count(token) < 3 or token not in err:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(command, timeout)
+            for key, _ in self.selector.select(remaining):
+                chunk = os.read(key.fd, CHUNK_SIZE)
+                if not chunk:
+                    raise SessionBroken('bash 已退出')
+                self.buffers[key.data] += chunk
+
+        first = out.find(token)
+        second = out.find(token, first + len(token))
+        third = out.find(token, second + len(token))
+        status = out[first + len(token):second].decode().splitlines()
+        rc = int(status[0])
+        # 工作目录、umask、后台任务数、变量/选项/函数/ulimit/trap 的摘要
+        settings = _stable_settings(out[second + len(token):third].decode(errors='replace'))
+        settings = hashlib.sha1(settings.encode()).hexdigest()
+        state = (status[1], status[2], len(status) - 3, settings)
+        stdout = bytes(out[:first])
+        stderr_end = err.find(token)
+        stderr = bytes(err[:stderr_end])
+        del out[:third + len(token) + 1]
+        del err[:stderr_end + len(token) + 1]
+
+        self.commands += 1
+        return rc, stdout.decode(errors='replace'), stderr.decode(errors='replace'), state
+
+    def reusable(self, state):
+        return (self.process.poll() is None
+                and self.commands < self.max_commands
+                and (self.initial_state is None or state == self.initial_state))
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.process.wait()
+        self.selector.close()
+        for stream in (self.process.stdin, self.process.stdout, self.process.stderr):
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+
+
+class ShellPool:
+    def __init__(self, size=2, max_commands=1000):
+        self.max_commands = max_commands
+        self.sessions = queue.Queue()
+        self.recycled = 0
+        for _ in range(size):
+            self.sessions.put(ShellSession(max_commands))
+
+    def execute_command(self, cmd, timeout=None):
+        """执行命令并提供友好的错误处理，cmd 可以是参数列表或 shell 命令字符串"""
+        command = cmd if isinstance(cmd, str) else shlex.join(cmd)
+        session = self.sessions.get()
+        state = None
+        try:
+            returncode, stdout, stderr, state = session.run(command, timeout)
+            if returncode == 127 and 'command not found' in stderr:
+                return {
+                    'success': False,
+                    'error': f"找不到命令: {shlex.split(command)[0]}",
+                    'error_type': 'command_not_found'
+                }
+            if returncode != 0:
+                return {
+                    'success': False,
+                    'error': f"命令返回非零状态码: {returncode}",
+                    'stdout': stdout,
+                    'stderr': stderr,
+                    'returncode': returncode,
+                    'error_type': 'non_zero_exit'
+                }
+            return {
+                'success': True,
+                'stdout': stdout,
+                'stderr': stderr,
+                'returncode': returncode
+            }
+        except subprocess.TimeoutExpired:
+            return {
+                'success': False,
+                'error': f"命令执行超时: {timeout}秒",
+                'error_type': 'timeout'
+            }
+        except SessionBroken:
+            # 命令中执行了 exit: bash 的退出码就是这条命令的返回码
+            returncode = session.process.wait()
+            result = {
+                'success': returncode == 0,
+                'stdout': session.buffers['stdout'].decode(errors='replace'),
+                'stderr': session.buffers['stderr'].decode(errors='replace'),
+                'returncode': returncode
+            }
+            if returncode != 0:
+                result['error'] = f"命令返回非零状态码: {returncode}"
+                result['error_type'] = 'non_zero_exit'
+            return result
+        finally:
+            if state is not None and session.reusable(state):
+                self.sessions.put(session)
+            else:
+                # 超时、会话退出或状态被修改: 重建会话
+                session.close()
+                self.recycled += 1
+                self.sessions.put(ShellSession(self.max_commands))
+
+    def close(self):
+        while not self.sessions.empty():
+            self.sessions.get().close()
+
+
+def execute_command(cmd, timeout=None):
+    """04-user-defined-except-process.py 中每次启动新进程的实现，用于对比"""
+    try:
+        result = subprocess.run(cmd,
+                                capture_output=True,
+                                text=True,
+                                check=True,
+                                timeout=timeout)
+        return {
+            'success': True,
+            'stdout': result.stdout,
+            'stderr': result.stderr,
+            'returncode': result.returncode
+        }
+    except FileNotFoundError:
+        return {
+            'success': False,
+            'error': f"找不到命令: {cmd[0]}",
+            'error_type': 'command_not_found'
+        }
+    except subprocess.CalledProcessError as e:
+        return {
+            'success': False,
+            'error': f"命令返回非零状态码: {e.returncode}",
+            'stdout': e.stdout,
+            'stderr': e.stderr,
+            'returncode': e.returncode,
+            'error_type': 'non_zero_exit'
+        }
+    except subprocess.TimeoutExpired:
+        return {
+            'success': False,
+            'error': f"命令执行超时: {timeout}秒",
+            'error_type': 'timeout'
+        }
+
+
+# 测试
+pool = ShellPool(size=2)
+
+result = pool.execute_command(['ls', '-l'])
+if result['success']:
+    print(f"命令输出:\n{result['stdout']}")
+else:
+    print(f"错误: {result['error']}")
+
+for cmd in (['echo', 'hello world'],
+            ['printf', 'no trailing newline'],
+            ['ls', 'non_existent_file'],
+            ['non_existent_command'],
+            'echo out; echo err >&2; exit 3',
+            "echo 'unterminated",
+            'sleep 5'):
+    result = pool.execute_command(cmd, timeout=1)
+    print(f"{cmd}: {result}")
+
+# 修改会话状态的命令执行后，会话被重建
+print(f"\n重建次数: {pool.recycled}")
+pool.execute_command('cd /tmp')
+pool.execute_command('export FOO=1; umask 077')
+print(f"执行 cd 和 umask 后重建次数: {pool.recycled}")
+pool.execute_command('export BAR=1')
+pool.execute_command('set -e')
+pool.execute_command('greet() { echo hi; }')
+print(f"修改环境变量、shell 选项和函数后重建次数: {pool.recycled}")
+for cmd in ('secret=hunter2', 'IFS=o', 'ulimit -n 50', "trap 'echo x' EXIT"):
+    pool.execute_command(cmd)
+print(f"修改普通变量、IFS、ulimit 和 trap 后重建次数: {pool.recycled}")
+print(f"不修改状态的命令不会触发重建: {pool.execute_command('echo $((RANDOM * 0 + SECONDS * 0))')['stdout'].strip()}, "
+      f"重建次数: {pool.recycled}")
+print(f"新会话中 BAR={pool.execute_command('echo $BAR')['stdout'].strip()!r}, "
+      f"greet: {pool.execute_command('greet')['error_type']}")
+print(f"当前目录仍然是: {pool.execute_command(['pwd'])['stdout'].strip()}")
+
+# 性能对比
+n = 1000
+start = time.perf_counter()
+for i in range(n):
+    execute_command(['echo', str(i)])
+elapsed = time.perf_counter() - start
+print(f"\n每次启动新进程: {n / elapsed:.0f} 个命令/秒")
+
+start = time.perf_counter()
+for i in range(n):
+    pool.execute_command(['echo', str(i)])
+elapsed = time.perf_counter() - start
+print(f"常驻 shell 会话: {n / elapsed:.0f} 个命令/秒")
+
+pool.close()
@@ -0,0 +1,197 @@
+"""
+可执行文件路径索引
+subprocess.run/Popen 每次启动子进程都会按 PATH 逐个目录尝试 execve，
+which/where 查找也要对每个目录做一次 stat
+这里在进程内建立一次 "命令名 -> 绝对路径" 的索引，
+按目录 mtime 判断是否失效 (最多每 check_interval 秒检查一次)，
+启动时直接传入绝对路径，跳过重复的 PATH 扫描
+只解析参数列表形式的命令: 字符串命令、shell=True 或指定了 executable 时原样交给 subprocess
+PATH 中有相对目录 (包括空项，即当前目录) 时结果取决于工作目录 (以及 cwd= 参数)，不使用索引
+"""
+import functools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+MAX_TABLES = 16  # 最多保留几个不同 PATH 的索引
+
+
+@functools.lru_cache(maxsize=MAX_TABLES)
+def _has_relative(path):
+    """PATH 中是否有相对目录，结果按 PATH 缓存，避免每次查找都拆分很长的 PATH"""
+    return any(not os.path.isabs(directory) for directory in path.split(os.pathsep))
+
+
+class ExecutableIndex:
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        # PATH -> [目录 mtime 列表, 索引, 上次检查时间]，不同的 PATH 各有一份索引
+        self.tables = {}
+
+    def _build(self, path):
+        index = {}
+        dir_mtimes = []
+        for directory in path.split(os.pathsep):
+            try:
+                dir_mtimes.append((directory, os.stat(directory).st_mtime_ns))
+                entries = os.scandir(directory)
+            except OSError:
+                dir_mtimes.append((directory, None))
+                continue
+            with entries:
+                for entry in entries:
+                    # PATH 中靠前的目录优先
+                    if entry.name in index:
+                        continue
+                    try:
+                        if entry.is_file() and os.access(entry.path, os.X_OK):
+                            index[entry.name] = entry.path
+                    except OSError:
+                        pass
+        return dir_mtimes, index
+
+    @staticmethod
+    def _stale(dir_mtimes):
+        for directory, mtime in dir_mtimes:
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                return True
+        return False
+
+    def resolve(self, name, path=None):
+        """返回命令的绝对路径，找不到时返回 None
+        path 为 None 时使用当前进程的 PATH"""
+        if os.sep in name:
+            return name
+        if path is None:
+            path = os.environ.get('PATH', os.defpath)
+        if _has_relative(path):
+            # 相对目录随当前工作目录变化，不能缓存
+            result = shutil.which(name, path=path)
+            return None if result is None else os.path.abspath(result)
+        now = time.monotonic()
+        with self.lock:
+            table = self.tables.get(path)
+            if table is None:
+                if len(self.tables) >= MAX_TABLES:
+                    del self.tables[next(iter(self.tables))]  # 丢弃最早建立的索引
+                table = self.tables[path] = [*self._build(path), now]
+            elif now - table[2] >= self.check_interval:
+                # 目录中增删文件会改变目录的 mtime
+                if self._stale(table[0]):
+                    table[0], table[1] = self._build(path)
+                table[2] = now
+            return table[1].get(name)
+
+    def resolve_command(self, cmd, env=None, shell=False, executable=None):
+        """把 cmd[0] 替换为绝对路径，找不到时保持原样由 subprocess 报错
+        传入 env 时与 subprocess 一样按 env 中的 PATH 查找
+        字符串命令、shell=True、指定了 executable 或 PATH 含相对目录时保持原样"""
+        if shell or executable is not None or not isinstance(cmd, (list, tuple)):
+            return cmd
+        path = os.environ.get('PATH', os.defpath) if env is None else env.get('PATH', os.defpath)
+        if _has_relative(path):
+            # subprocess 在子进程切换到 cwd 之后才按相对目录查找，交给它处理
+            return cmd
+        resolved = self.resolve(cmd[0], path)
+        if resolved is None:
+            return cmd
+        return [resolved] + list(cmd[1:])
+
+
+executable_index = ExecutableIndex()
+
+
+def _resolve_args(cmd, kwargs):
+    return executable_index.resolve_command(cmd, kwargs.get('env'), kwargs.get('shell', False),
+                                            kwargs.get('executable'))
+
+
+def run(cmd, **kwargs):
+    """与 subprocess.run 相同，但通过索引解析命令路径"""
+    return subprocess.run(_resolve_args(cmd, kwargs), **kwargs)
+
+
+def popen(cmd, **kwargs):
+    """与 subprocess.Popen 相同，但通过索引解析命令路径"""
+    return subprocess.Popen(_resolve_args(cmd, kwargs), **kwargs)
+
+
+def find_file(name):
+    """代替 get_platform_specific_command('find_file') 中的 which/where"""
+    return executable_index.resolve(name)
+
+
+# 测试
+print(f"python3 -> {find_file('python3')}")
+print(f"ls -> {find_file('ls')}")
+print(f"non_existent_command -> {find_file('non_existent_command')}")
+result = run(['echo', 'Hello World'], capture_output=True, text=True)
+print(f"输出: {result.stdout.strip()}")
+# 字符串命令和 executable 原样交给 subprocess
+print(f"shell=True: {run('whoami', shell=True, capture_output=True, text=True).stdout.strip()}")
+print(f"executable=: {run(['custom-argv0', '-c', 'echo $0'], executable='/bin/sh', capture_output=True, text=True).stdout.strip()}")
+
+# 新增可执行文件后索引自动失效
+with tempfile.TemporaryDirectory() as tmpdir:
+    os.environ['PATH'] = tmpdir + os.pathsep + os.environ['PATH']
+    print(f"\n新目录中的 hello: {find_file('hello')}")
+    script = os.path.join(tmpdir, 'hello')
+    with open(script, 'w') as f:
+        f.write('#!/bin/sh\necho hello from script\n')
+    os.chmod(script, 0o755)
+    time.sleep(executable_index.check_interval)
+    print(f"添加后 hello: {find_file('hello')}")
+    print(f"运行: {run(['hello'], capture_output=True, text=True).stdout.strip()}")
+    # env 中的 PATH 不包含这个目录时，与 subprocess 一样找不到 hello
+    env = dict(os.environ, PATH=os.defpath)
+    try:
+        run(['hello'], env=env)
+    except FileNotFoundError as e:
+        print(f"env 中的 PATH 不含 {tmpdir}: {e}")
+
+    # PATH 中的相对目录按 cwd= 查找，与 subprocess 一致
+    os.makedirs(os.path.join(tmpdir, 'project', 'bin'))
+    os.rename(script, os.path.join(tmpdir, 'project', 'bin', 'hello'))
+    env = dict(os.environ, PATH='bin' + os.pathsep + os.defpath)
+    result = run(['hello'], env=env, cwd=os.path.join(tmpdir, 'project'), capture_output=True, text=True)
+    print(f"相对 PATH 目录 + cwd: {result.stdout.strip()}")
+
+    # 很长的 PATH: 在前面加 300 个目录
+    original_path = os.environ['PATH']
+    extra = [os.path.join(tmpdir, f'bin{i}') for i in range(300)]
+    for directory in extra:
+        os.mkdir(directory)
+    os.environ['PATH'] = os.pathsep.join(extra) + os.pathsep + original_path
+
+    n = 10000
+    start = time.perf_counter()
+    for _ in range(n):
+        shutil.which('true')
+    which_time = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for _ in range(n):
+        find_file('true')
+    index_time = (time.perf_counter() - start) / n
+    print(f"\nPATH 共 {len(os.environ['PATH'].split(os.pathsep))} 个目录")
+    print(f"查找 true: shutil.which {which_time * 1e6:.1f} 微秒, 索引 {index_time * 1e6:.2f} 微秒")
+
+    n = 1000
+    start = time.perf_counter()
+    for _ in range(n):
+        subprocess.run(['true'])
+    plain = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for _ in range(n):
+        run(['true'])
+    indexed = (time.perf_counter() - start) / n
+    print(f"启动 true: 按 PATH 查找 {plain * 1000:.3f} 毫秒, 使用索引 {indexed * 1000:.3f} 毫秒, "
+          f"每次节省 {(plain - indexed) * 1e6:.0f} 微秒")
+    os.environ['PATH'] = original_path
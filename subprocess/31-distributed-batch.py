@@ -0,0 +1,442 @@
+"""
+多节点分布式批量执行: 协调者 (coordinator) + 代理 (agent)
+代理进程可以在本机或其他主机上启动，通过 Unix 套接字或 TCP 连接协调者 (address='host:port')，
+主动向协调者拉取命令 (按额度批量下发)，在本地并发执行，再把结果流式发回
+协调者的全局队列为空时，会让积压最多的代理交还尚未开始的命令，分给空闲的代理 (work stealing)
+协调者只负责转发很小的二进制帧，进程创建和输出读取都在代理中完成，
+因此可以驱动比单个进程多得多的 CPU 核
+所有代理都断开且不会再有代理连接时报错，不会一直等待
+指定 job_timeout 时，协调者把超时未返回结果的命令记为失败，不会被卡住的命令或代理拖住
+注意: 测试部分在一台 Linux 机器上启动多个本地代理，外部代理也在本机通过 TCP 模拟
+
+用法: python 31-distributed-batch.py --agent <套接字路径 | host:port> <并发数>
+"""
+import asyncio
+import collections
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+# 帧格式: 类型 (1 字节) + 负载长度 (4 字节) + 负载
+HEADER = struct.Struct('!BI')
+REQUEST, TASKS, RESULT, STEAL, GIVEBACK, DONE = range(6)
+CONNECT_TIMEOUT = 10  # 代理连接协调者的最长等待秒数
+
+
+def encode_tasks(tasks):
+    """[(任务 id, argv)] -> 字节: 任务数, 然后每个任务为 id、参数个数、各参数 (长度 + 内容)
+    长度都用 4 字节，单个参数可以超过 64KB"""
+    parts = [struct.pack('!I', len(tasks))]
+    for task_id, argv in tasks:
+        parts.append(struct.pack('!II', task_id, len(argv)))
+        for arg in argv:
+            data = arg.encode()
+            parts.append(struct.pack('!I', len(data)))
+            parts.append(data)
+    return b''.join(parts)
+
+
+def decode_tasks(payload):
+    (count,), offset = struct.unpack_from('!I', payload), 4
+    tasks = []
+    for _ in range(count):
+        task_id, argc = struct.unpack_from('!II', payload, offset)
+        offset += 8
+        argv = []
+        for _ in range(argc):
+            (length,) = struct.unpack_from('!I', payload, offset)
+            offset += 4
+            argv.append(payload[offset:offset + length].decode())
+            offset += length
+        tasks.append((task_id, argv))
+    return tasks
+
+
+def encode_result(task_id, returncode, stdout, stderr):
+    return struct.pack('!IiII', task_id, returncode, len(stdout), len(stderr)) + stdout + stderr
+
+
+def decode_result(payload):
+    task_id, returncode, out_len, err_len = struct.unpack_from('!IiII', payload)
+    offset = 16
+    stdout = payload[offset:offset + out_len]
+    stderr = payload[offset + out_len:offset + out_len + err_len]
+    return task_id, returncode, stdout, stderr
+
+
+async def read_frame(reader):
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return kind, await reader.readexactly(length) if length else b''
+
+
+def write_frame(writer, kind, payload=b''):
+    writer.write(HEADER.pack(kind, len(payload)) + payload)
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)，Unix 套接字路径 -> None"""
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return None
+
+
+async def open_connection(address, timeout=CONNECT_TIMEOUT):
+    """连接协调者，协调者还没有开始监听时每 0.1 秒重试一次"""
+    tcp = parse_address(address)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if tcp:
+                return await asyncio.open_connection(*tcp)
+            return await asyncio.open_unix_connection(address)
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+# ---------------- 代理 ----------------
+
+async def run_agent(address, workers):
+    """连接协调者，拉取并执行命令，直到收到 DONE 且本地任务全部完成"""
+    reader, writer = await open_connection(address)
+    local = collections.deque()  # 已拉取、尚未开始的任务
+    running = set()
+    credits = 0  # 已申请但尚未收到的任务数
+    done = False
+    prefetch = workers * 4
+
+    def request_more():
+        nonlocal credits
+        want = prefetch - len(local) - len(running) - credits
+        if want > 0 and not done:
+            credits += want
+            write_frame(writer, REQUEST, struct.pack('!II', want, workers))
+
+    processes = set()  # 正在运行的子进程
+
+    async def execute(task_id, argv):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            processes.add(process)
+            try:
+                stdout, stderr = await process.communicate()
+            finally:
+                processes.discard(process)
+            returncode = process.returncode
+        except OSError as e:
+            returncode, stdout, stderr = 127, b'', str(e).encode()
+        except Exception as e:
+            # 例如参数中含有 NUL 字符 (ValueError): 同样要发回结果，否则协调者会一直等待
+            returncode, stdout, stderr = 1, b'', f"{type(e).__name__}: {e}".encode()
+        write_frame(writer, RESULT, encode_result(task_id, returncode, stdout, stderr))
+
+    def start_tasks():
+        while local and len(running) < workers:
+            task = asyncio.create_task(execute(*local.popleft()))
+            running.add(task)
+            task.add_done_callback(on_finished)
+
+    def on_finished(task):
+        running.discard(task)
+        start_tasks()
+        request_more()
+
+    request_more()
+    await writer.drain()
+    while True:
+        try:
+            kind, payload = await read_frame(reader)
+        except asyncio.IncompleteReadError:
+            break
+        if kind == TASKS:
+            tasks = decode_tasks(payload)
+            credits -= len(tasks)
+            local.extend(tasks)
+            start_tasks()
+            request_more()
+        elif kind == STEAL:
+            # 交还队尾尚未开始的任务
+            (count,) = struct.unpack('!I', payload)
+            given = [local.pop() for _ in range(min(count, len(local)))]
+            write_frame(writer, GIVEBACK, encode_tasks(given))
+            request_more()
+        elif kind == DONE:
+            done = True
+            # 协调者已经有了所有结果，仍在运行的只可能是被判定为超时的命令
+            for process in processes:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+            break
+        await writer.drain()
+
+    while running:
+        await asyncio.gather(*running)
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+# ---------------- 协调者 ----------------
+
+class Coordinator:
+    def __init__(self, commands, expected_agents=0, job_timeout=None):
+        self.commands = commands
+        self.job_timeout = job_timeout
+        self.queue = collections.deque(enumerate(commands))  # 全局工作队列
+        self.results = {}
+        self.agents = {}  # writer -> 状态
+        self.all_agents = []
+        self.expected_agents = expected_agents  # 外部启动的代理数，全部连接过之后才可能判定为失败
+        self.local_exited = True  # 本机启动的代理进程是否都已经退出
+        self.error = None
+        self.finished = asyncio.Event()
+        self.steals = 0
+        if not commands:
+            self.finished.set()
+
+    @staticmethod
+    def backlog(agent):
+        """已分配但估计尚未开始的任务数"""
+        return len(agent['assigned']) - agent['workers']
+
+    def dispatch(self):
+        """把全局队列中的任务按各代理的申请额度下发，积压少的代理优先，队列为空时发起窃取"""
+        for writer, agent in sorted(self.agents.items(), key=lambda item: self.backlog(item[1])):
+            if agent['wanted'] <= 0:
+                continue
+            if self.queue:
+                count = min(agent['wanted'], len(self.queue))
+                tasks = [self.queue.popleft() for _ in range(count)]
+                agent['wanted'] -= count
+                self.assign(agent, tasks)
+                write_frame(writer, TASKS, encode_tasks(tasks))
+            elif self.backlog(agent) <= 0:
+                self.steal_for(agent)
+
+    def assign(self, agent, tasks):
+        """记录下发给代理的任务，指定 job_timeout 时为每个任务设置超时"""
+        loop = asyncio.get_running_loop()
+        for task_id, _ in tasks:
+            timer = None
+            if self.job_timeout is not None:
+                timer = loop.call_later(self.job_timeout, self.expire, agent, task_id)
+            agent['assigned'][task_id] = timer
+
+    def unassign(self, agent, task_id):
+        timer = agent['assigned'].pop(task_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def expire(self, agent, task_id):
+        """下发后超过 job_timeout 仍没有结果 (包括在代理中排队的时间): 记为超时，之后到达的结果被忽略"""
+        del agent['assigned'][task_id]
+        self.record(task_id, (None, b'', f"命令执行超时: {self.job_timeout}秒".encode()))
+
+    def record(self, task_id, result):
+        if task_id in self.results:
+            return  # 已经超时的命令
+        self.results[task_id] = result
+        if len(self.results) == len(self.commands):
+            self.finish()
+
+    def steal_for(self, idle_agent):
+        """找积压最多的代理，让它交还一半尚未开始的任务"""
+        victim_writer, victim = max(self.agents.items(), key=lambda item: self.backlog(item[1]))
+        if victim is idle_agent or self.backlog(victim) < 2 or victim['stealing']:
+            return
+        victim['stealing'] = True
+        self.steals += 1
+        write_frame(victim_writer, STEAL, struct.pack('!I', self.backlog(victim) // 2))
+
+    def finish(self):
+        self.finished.set()
+        for writer in self.agents:
+            write_frame(writer, DONE)
+
+    def check_lost(self):
+        """已经没有代理、也不会再有代理连接，但还有未完成的命令: 报错而不是一直等待"""
+        if (self.finished.is_set() or self.agents or not self.local_exited
+                or len(self.all_agents) < self.expected_agents):
+            return
+        self.error = RuntimeError(f"所有代理都已断开，还有 {len(self.commands) - len(self.results)} 个命令未完成")
+        self.finished.set()
+
+    async def handle_agent(self, reader, writer):
+        agent = {'wanted': 0, 'assigned': {}, 'workers': 1, 'stealing': False, 'completed': 0}
+        self.agents[writer] = agent
+        self.all_agents.append(agent)
+        if self.finished.is_set():
+            write_frame(writer, DONE)  # 已经全部完成后才连接的代理
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == REQUEST:
+                    count, agent['workers'] = struct.unpack('!II', payload)
+                    agent['wanted'] += count
+                elif kind == RESULT:
+                    task_id, returncode, stdout, stderr = decode_result(payload)
+                    self.unassign(agent, task_id)
+                    agent['completed'] += 1
+                    self.record(task_id, (returncode, stdout, stderr))
+                elif kind == GIVEBACK:
+                    tasks = decode_tasks(payload)
+                    agent['stealing'] = False
+                    for task_id, _ in tasks:
+                        self.unassign(agent, task_id)
+                    self.queue.extendleft(reversed([task for task in tasks if task[0] not in self.results]))
+                if not self.finished.is_set():
+                    self.dispatch()
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # 代理断开: 正常结束时 assigned 为空，异常断开时把未完成的任务放回队列
+            for task_id in list(agent['assigned']):
+                self.unassign(agent, task_id)
+                self.queue.appendleft((task_id, self.commands[task_id]))
+        finally:
+            del self.agents[writer]
+            writer.close()
+        if not self.finished.is_set():
+            self.dispatch()
+            self.check_lost()
+
+
+def to_result(cmd, returncode, stdout, stderr):
+    """转换成 run_command 的返回结构，returncode 为 None 表示超时"""
+    if returncode is None:
+        return {'cmd': cmd, 'success': False, 'error': stderr.decode()}
+    if returncode == 0:
+        return {'cmd': cmd, 'success': True, 'output': stdout.decode(errors='replace')}
+    return {'cmd': cmd, 'success': False,
+            'error': f"返回码 {returncode}: {stderr.decode(errors='replace').strip()}"}
+
+
+async def distributed_batch_execute(commands, agents=(4,), address=None, expected_agents=0, job_timeout=None):
+    """执行命令，返回结果和统计信息
+    agents 为在本机启动的各代理的并发数；address 为监听地址，Unix 套接字路径或 'host:port'，
+    在其他主机上用 --agent host:port 启动的代理连接到这里，expected_agents 为这些代理的数量
+    job_timeout 为每个命令从下发到代理开始的最长秒数，超时的命令记为失败
+    所有代理都断开且不会再有代理连接时抛出 RuntimeError"""
+    tmpdir = tempfile.TemporaryDirectory() if address is None else None
+    if tmpdir is not None:
+        address = os.path.join(tmpdir.name, 'coordinator.sock')
+    try:
+        return await _distributed_batch_execute(commands, agents, address, expected_agents, job_timeout)
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+
+async def _distributed_batch_execute(commands, agents, address, expected_agents, job_timeout):
+    coordinator = Coordinator(commands, expected_agents, job_timeout)
+    tcp = parse_address(address)
+    if tcp:
+        server = await asyncio.start_server(coordinator.handle_agent, *tcp)
+        # 端口为 0 时使用实际分配的端口
+        address = f"{tcp[0]}:{server.sockets[0].getsockname()[1]}"
+    else:
+        server = await asyncio.start_unix_server(coordinator.handle_agent, path=address)
+
+    agent_processes = [
+        await asyncio.create_subprocess_exec(sys.executable, __file__, '--agent', address, str(workers))
+        for workers in agents
+    ]
+
+    async def watch_agents():
+        await asyncio.gather(*(process.wait() for process in agent_processes))
+        coordinator.local_exited = True
+        coordinator.check_lost()
+
+    coordinator.local_exited = not agent_processes
+    watcher = asyncio.create_task(watch_agents())
+    coordinator.check_lost()
+    await coordinator.finished.wait()
+    if coordinator.error is None:
+        await watcher
+    else:
+        watcher.cancel()
+    server.close()
+    await server.wait_closed()
+    if not tcp:
+        os.remove(address)
+    if coordinator.error is not None:
+        raise coordinator.error
+
+    results = [to_result(commands[i], *coordinator.results[i]) for i in range(len(commands))]
+    per_agent = [agent['completed'] for agent in coordinator.all_agents]
+    return results, {'steals': coordinator.steals, 'completed_per_agent': per_agent}
+
+
+if len(sys.argv) == 4 and sys.argv[1] == '--agent':
+    asyncio.run(run_agent(sys.argv[2], int(sys.argv[3])))
+    sys.exit(0)
+
+# 测试批量执行
+commands = [
+    ['echo', 'Hello World'],
+    ['ls', '-l'],
+    ['date'],
+    ['whoami'],
+    ['non_existent_command']  # 这个会失败
+]
+results, stats = asyncio.run(distributed_batch_execute(commands, agents=(2, 2)))
+for result in results:
+    if result['success']:
+        print(f"命令 {result['cmd']} 成功: {result['output'].strip()[:40]}")
+    else:
+        print(f"命令 {result['cmd']} 失败: {result['error']}")
+
+# 单个参数超过 64KB
+results, _ = asyncio.run(distributed_batch_execute([['printf', '%.5s...', 'x' * 100000]], agents=(1,)))
+print(f"\n100000 字节的参数: {results[0]['output']}")
+
+# 没有命令时立即返回
+start = time.perf_counter()
+results, _ = asyncio.run(distributed_batch_execute([], agents=(2,)))
+print(f"空命令列表: {results}, 耗时 {time.perf_counter() - start:.2f} 秒")
+
+# 代理全部异常退出时报错，而不是一直等待 (命令杀掉了执行它的代理，模拟代理所在的主机宕机)
+try:
+    asyncio.run(distributed_batch_execute([['bash', '-c', 'kill -9 $PPID']] * 4, agents=(1, 1)))
+except RuntimeError as e:
+    print(f"代理全部退出: {e}")
+
+# 无法启动的命令 (参数中含有 NUL) 返回错误结果；超时的命令记为失败，不会一直等待
+start = time.perf_counter()
+results, _ = asyncio.run(distributed_batch_execute([['echo', 'ok'], ['echo', 'a\0b'], ['sleep', '30']],
+                                                   agents=(2,), job_timeout=1))
+print(f"含 NUL 和超时的命令 (耗时 {time.perf_counter() - start:.2f} 秒):")
+for result in results:
+    print(f"  {result['cmd']}: {result.get('output', '').strip() or result['error']}")
+
+
+# 通过 TCP 连接的外部代理 (这里在本机用 --agent host:port 启动，模拟其他主机上的代理)
+async def run_with_external_agents(commands):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    external = [await asyncio.create_subprocess_exec(sys.executable, __file__, '--agent', f'127.0.0.1:{port}', '4')
+                for _ in range(2)]
+    result = await distributed_batch_execute(commands, agents=(), address=f'127.0.0.1:{port}', expected_agents=2)
+    await asyncio.gather(*(process.wait() for process in external))
+    return result
+
+results, stats = asyncio.run(run_with_external_agents([['echo', f'tcp {i}'] for i in range(20)]))
+print(f"TCP 外部代理: 成功 {sum(r['success'] for r in results)} 个, 各代理完成数: {stats['completed_per_agent']}")
+
+# 并发能力不同的代理: 慢代理预取的任务会被快代理窃取
+n = 400
+commands = [['sleep', '0.05']] * n
+start = time.perf_counter()
+results, stats = asyncio.run(distributed_batch_execute(commands, agents=(1, 8, 8)))
+elapsed = time.perf_counter() - start
+print(f"\n{n} 个命令, 3 个代理 (并发 1/8/8): 耗时 {elapsed:.2f} 秒, "
+      f"成功 {sum(r['success'] for r in results)} 个")
+print(f"窃取次数: {stats['steals']}, 各代理完成数: {stats['completed_per_agent']}")